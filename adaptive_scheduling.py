@@ -1,11 +1,12 @@
 import math
 import numpy as np
 
-from scipy.stats import poisson
-from scipy.optimize import minimize, LinearConstraint # optimization
+from functools import partial
+from solvers import solve # optimization
 from scipy.linalg.blas import dgemm, dgemv # matrix multiplication
-from scipy.linalg import inv # matrix inversion
-from scipy.sparse.linalg import expm # matrix exponential
+from scipy.linalg import expm # matrix exponential
+
+from kernels import expm_action, poisson_pmf, BlockBidiagonal
 
 
 def find_Salpha(mean, SCV, u):
@@ -24,10 +25,9 @@ def find_Salpha(mean, SCV, u):
         mu = (K + 1 - p) / mean
         
         # initial dist. client in service
-        alpha_start = np.zeros((1,K+1))
-        B_sf = poisson.cdf(K-1, mu*u) + (1 - p) * poisson.pmf(K,mu*u)
-        for z in range(K+1):
-            alpha_start[0,z] = poisson.pmf(z,mu*u) / B_sf
+        P = poisson_pmf(K, mu*u)
+        B_sf = np.sum(P[:K]) + (1 - p) * P[K]
+        alpha_start = (P / B_sf).reshape(1,K+1)
         alpha_start[0,K] *= (1 - p) 
         
         # initial dist. other clients
@@ -69,11 +69,15 @@ def find_Salpha(mean, SCV, u):
     return S, alpha_start, alpha
 
 
-def create_Sn(S, alpha_start, alpha, N):
+def create_Sn(S, alpha_start, alpha, N, structured=False):
     """
     Creates the matrix Sn as given in Kuiper, Kemper, Mandjes, Sect. 3.2.
+    If structured, Sn is returned in BlockBidiagonal form.
     """
 
+    if structured:
+        return BlockBidiagonal([S] * (N+1), [-np.sum(S,1)] * N, [alpha] * N)
+
     B = np.matrix(-sum(S.T)).T @ alpha
     m = S.shape[0]
     
@@ -92,11 +96,28 @@ def create_Sn(S, alpha_start, alpha, N):
     return S_new
 
 
-def Transient_EIEW(x, alpha_start, alpha, Sn, Sn_inv, omega, wis):
+def P_Sn_inv(P, Sn_inv, i, m):
+    """
+    Returns P @ Sn_inv[0:i*m,0:i*m], where Sn_inv is either the
+    dense inverse of Sn or Sn in BlockBidiagonal form, in which
+    case the product is computed by block forward substitution.
+    """
+
+    if isinstance(Sn_inv, BlockBidiagonal):
+        return Sn_inv.solve_left(P, i)
+
+    return dgemm(1, P, Sn_inv[0:i*m,0:i*m])
+
+
+def Transient_EIEW(x, alpha_start, alpha, Sn, Sn_inv, omega, wis, method='expm', tol=1e-12):
     """
     Evaluates the cost function given all parameters.
     In here, we used the FORTRAN dgem-functions 
     instead of @ for efficient matrix multiplication.
+    With method='action', the matrix exponentials are
+    never formed: P and the sojourn row vector are
+    propagated together by expm_action.
+    Sn_inv may also be Sn in BlockBidiagonal form.
     """
     
     N = x.shape[0]
@@ -108,7 +129,7 @@ def Transient_EIEW(x, alpha_start, alpha, Sn, Sn_inv, omega, wis):
     # cost of clients already entered (only waiting time)
     for i in range(1,wis+1):
         
-        cost += (omega - 1) * np.sum(dgemm(1, P_alpha_F, Sn_inv[0:i*m,0:i*m]))
+        cost += (omega - 1) * np.sum(P_Sn_inv(P_alpha_F, Sn_inv, i, m))
         
         F = 1 - np.sum(P_alpha_F)
         P_alpha_F = np.hstack((np.matrix(P_alpha_F), alpha * F))
@@ -116,37 +137,52 @@ def Transient_EIEW(x, alpha_start, alpha, Sn, Sn_inv, omega, wis):
     # cost of clients to be scheduled
     for i in range(wis+1,N+wis+1):
                 
-        exp_Si = expm(Sn[0:i*m,0:i*m] * x[i-wis-1])
-        cost += float(dgemv(1, dgemm(1, P_alpha_F, Sn_inv[0:i*m,0:i*m]), np.sum(omega * np.eye(i*m) - exp_Si,1)))
+        P_inv = P_Sn_inv(P_alpha_F, Sn_inv, i, m)
+        
+        if method == 'expm':
+            exp_Si = expm(Sn[0:i*m,0:i*m] * x[i-wis-1])
+            cost += float(dgemv(1, P_inv, np.sum(omega * np.eye(i*m) - exp_Si,1))[0])
+            P = dgemm(1, P_alpha_F, exp_Si)
+        else:
+            P, P_inv_exp = expm_action(np.vstack((P_alpha_F, P_inv)), Sn[0:i*m,0:i*m], x[i-wis-1], tol)
+            cost += omega * np.sum(P_inv) - np.sum(P_inv_exp)
+            P = P.reshape(1,-1)
         
-        P = dgemm(1, P_alpha_F, exp_Si)
         F = 1 - np.sum(P)
         P_alpha_F = np.hstack((np.matrix(P), alpha * F))
 
     return cost
 
 
-def Transient_IA(SCV, u, omega, N, x0, wis=0, tol=1e-4):
+def Transient_IA(SCV, u, omega, N, x0, wis=0, tol=1e-4, method='expm', expm_tol=1e-12, solver='SLSQP',
+                 full_output=False, executor=None):
     """
     Computes the optimal schedule.
     wis = waiting in system.
+    If full_output, the optimization result (with the
+    iterations, evaluations and wall time) is returned too.
+    If an executor is given, the finite difference
+    gradient is evaluated concurrently.
     """
         
     # sojourn time distribution transition rate matrices
     S, alpha_start, alpha = find_Salpha(1, SCV, u)
-    Sn = create_Sn(S, alpha_start, alpha, N)
-    Sn_inv = inv(Sn)
+    Sn_inv = create_Sn(S, alpha_start, alpha, N, structured=True)  # replaces inv(Sn)
+    Sn = Sn_inv.tosparse() if method == 'action' else Sn_inv.todense()
     
     # minimization
     if not x0:
         x0 = np.array([1.5 + wis] + [1.5] * (N - wis - 1))
         
-    Trans_EIEW = lambda x: Transient_EIEW(x, alpha_start, alpha, Sn, Sn_inv, omega, wis)
-    lin_cons = LinearConstraint(np.eye(N - wis), 0, np.inf)
+    Trans_EIEW = partial(Transient_EIEW, alpha_start=alpha_start, alpha=alpha, Sn=Sn, Sn_inv=Sn_inv, omega=omega,
+                         wis=wis, method=method, tol=expm_tol)  # picklable for process pools
         
-    optimization = minimize(Trans_EIEW, x0, constraints=lin_cons, method='SLSQP', tol=tol)
+    optimization = solve(Trans_EIEW, x0, np.zeros(N - wis), solver, jac=False, tol=tol, executor=executor)
     x = optimization.x
     fval = optimization.fun
         
+    if full_output:
+        return x, fval, optimization
+
     return x, fval
 
@@ -0,0 +1,177 @@
+import os, ast
+import numpy as np
+
+from schedule_cache import cached_schedule
+import metrics  # instrumentation
+
+
+PARAMETERS = ('omega', 'n', 'means', 'SCVs', 'k', 'u', 'fixed_t', 'tau')
+
+# bounds on the size of a problem (the number of phases of a client is about 1/SCV)
+MAX_CLIENTS = int(os.environ.get('SCHEDULE_MAX_CLIENTS', 20))
+MIN_SCV = float(os.environ.get('SCHEDULE_MIN_SCV', 0.01))
+
+
+class ParameterError(ValueError):
+    """
+    Invalid input, with a message that can be shown to the user.
+    """
+
+
+def parse(value):
+    """
+    Parses a number, a list of numbers, or a string holding either
+    (e.g. '1, 1.5, 2'), without evaluating any code. Returns a
+    float or a list of floats, or None if value is empty.
+    """
+
+    if isinstance(value, str):
+        if not value.strip():
+            return None
+        value = ast.literal_eval(value)
+
+    if value is None:
+        return None
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, (list, tuple)) and all(isinstance(i, (int, float)) and not isinstance(i, bool)
+                                                 for i in value):
+        return [float(i) for i in value]
+
+    raise ValueError(f'Not a number or list of numbers: {value!r}.')
+
+
+def validate(omega, n, means, SCVs, k=0, u=0, fixed_t=None, tau=0):
+    """
+    Validates the inputs of the app (k = 0 means that the system is
+    idle, fixed_t are the fixed arrival times) and returns them as a
+    dict of parsed values. Raises ParameterError otherwise.
+    """
+
+    try:
+        omega, n, k, u, tau = [parse(v) for v in (omega, n, k, u, tau)]
+    except (ValueError, SyntaxError):
+        raise ParameterError('Error! Wrongly entered parameters.')
+    if any(not np.all(np.isfinite(v)) for v in (omega, n, k, u, tau) if v is not None):
+        raise ParameterError('Error! Note that the parameters must be finite.')
+    if isinstance(n, list) or n is None or n < 1 or n != int(n):
+        raise ParameterError(r'Error! Note that \(n\) must be a positive integer.')
+    if n > MAX_CLIENTS:
+        raise ParameterError(rf'Error! Note that \(n \leq {MAX_CLIENTS}\).')
+    if isinstance(omega, list) or omega is None or not 0 < omega < 1:
+        raise ParameterError(r'Error! Note that \(0 < \omega < 1\).')
+    if any(isinstance(v, list) for v in (k, u, tau)):
+        raise ParameterError('Error! Wrongly entered parameters.')
+    n, k, u, tau = int(n), int(k or 0), u or 0, tau or 0
+    if k < 0 or u < 0 or tau < 0:
+        raise ParameterError(r'Error! Note that \(k\), \(u\) and \(\tau\) must be non-negative.')
+
+    try:
+        means = parse(means)
+    except (ValueError, SyntaxError):
+        means = None
+    if means is None:
+        raise ParameterError('Error! No means entered.')
+    try:
+        SCVs = parse(SCVs)
+    except (ValueError, SyntaxError):
+        SCVs = None
+    if SCVs is None:
+        raise ParameterError('Error! No SCVs entered.')
+
+    means = [means] * n if isinstance(means, float) else means
+    SCVs = [SCVs] * n if isinstance(SCVs, float) else SCVs
+    if len(means) != n:
+        raise ParameterError('Error! Not enough means entered.')
+    if len(SCVs) != n:
+        raise ParameterError('Error! Not enough SCVs entered.')
+    if not np.all(np.isfinite(means + SCVs)):
+        raise ParameterError('Error! Note that the means and SCVs must be finite.')
+    if min(means) <= 0 or min(SCVs) <= 0:
+        raise ParameterError('Error! Note that the means and SCVs must be positive.')
+    if min(SCVs) < MIN_SCV:
+        raise ParameterError(rf'Error! Note that the SCVs must be at least {MIN_SCV}.')
+
+    if k >= n:
+        raise ParameterError(r'Error! Note that \(k < n\).')
+    if k == 0 and u > 0:
+        raise ParameterError(r'Error! Note that \(u > 0 \implies k > 0\).')
+
+    try:
+        fixed_t = parse(fixed_t)
+    except (ValueError, SyntaxError):
+        raise ParameterError('Error! Wrongly entered fixed arrival times.')
+    fixed_t = [] if not fixed_t else [fixed_t] if isinstance(fixed_t, float) else fixed_t
+
+    if not np.all(np.isfinite(fixed_t)) or min(fixed_t, default=0) < 0:
+        raise ParameterError(r'Error! Note that the fixed arrival times must be finite and non-negative.')
+
+    if len(fixed_t) > 1 and not all(i < j for i, j in zip(fixed_t, fixed_t[1:])):
+        raise ParameterError(r'Error! Note that the fixed arrival times must be increasing.')
+    if len(fixed_t) >= n - k:
+        raise ParameterError(r'Error! Note that \(\ell < n\).')
+    if len(fixed_t) and tau < fixed_t[-1]:
+        raise ParameterError(r'Error! Note that \(\tau \geq t_\ell\).')
+
+    return {'omega': omega, 'n': n, 'means': means, 'SCVs': SCVs, 'k': k, 'u': u, 'fixed_t': fixed_t, 'tau': tau}
+
+
+def problem(omega, n, means, SCVs, k, u, fixed_t, tau):
+    """
+    Maps validated inputs to one of the four cases (idle or a client
+    in service, without or with fixed arrival times). Returns the
+    case, the arguments of optimal_schedule, and the shifts of the
+    resulting schedule and cost.
+    """
+
+    if not k and not u:  # system is idle
+        if not len(fixed_t):
+            case, fixed_inter_times, min_time_next, t_shift = 1, [], 0, tau
+        else:
+            case, min_time_next = 2, tau - fixed_t[-1]
+            fixed_inter_times = [fixed_t[i] - fixed_t[i-1] for i in range(1,len(fixed_t))]
+            t_shift = fixed_t[0]
+        k_next, u_next = 1, 0
+
+    else:  # a client is in service
+        if not len(fixed_t):
+            case, fixed_inter_times, min_time_next = 3, [], tau
+        else:
+            case, min_time_next = 4, tau - fixed_t[-1]
+            fixed_inter_times = [fixed_t[0]] + [fixed_t[i] - fixed_t[i-1] for i in range(1,len(fixed_t))]
+        k_next, u_next, t_shift = k, u, 0
+
+    args = (means, SCVs, omega, [float(i) for i in fixed_inter_times], float(min_time_next), k_next, u_next)
+
+    return {'case': case, 'args': args, 't_shift': float(t_shift), 'cost_shift': omega * float(t_shift)}
+
+
+def compute(params, cache=None):
+    """
+    Computes (or looks up in the schedule cache) the optimal schedule
+    for validated inputs, and returns the arrival times of the clients
+    to be scheduled (numbered clients, as in the app) and the cost.
+    """
+
+    spec = problem(**params)
+
+    with metrics.request('api'):
+        schedule, cost = cached_schedule(*spec['args'], cache=cache)
+
+    return result(params, spec, schedule, cost)
+
+
+def result(params, spec, schedule, cost):
+    """
+    Returns the output of compute given the schedule and cost that
+    optimal_schedule returns for the problem spec of params.
+    """
+
+    if not np.isfinite(cost) or not np.all(np.isfinite(schedule)):  # not valid JSON, nor a schedule
+        raise ParameterError('Error! The appointment schedule could not be computed for these parameters.')
+
+    t = np.asarray(schedule) + spec['t_shift']
+    n = params['n']
+
+    return {'case': spec['case'], 'clients': list(range(n + 1 - len(t), n + 1)),
+            'arrival_times': t.tolist(), 'cost': float(cost) + spec['cost_shift']}
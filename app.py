@@ -3,19 +3,34 @@ import dash
 from dash import dash_table as dt
 from dash import html, dcc
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from markdown_helper import markdown_popup
+import os, logging
 import numpy as np
-import pandas as pd
-import plotly.graph_objs as go
+import plotly.graph_objs as go  # already loaded by dash
 
-from new_adaptive_scheduling import optimal_schedule as Schedule
+from jobs import default_queue
+from metrics import default_store
+from api import PARAMETERS, ParameterError, validate, problem, compute
+from schedule_cache import cached_schedule
+from new_adaptive_scheduling import warm_phase_fits
+from flask import Response, request, jsonify
+
+
+# startup (see prewarm)
+PREWARM = os.environ.get('SCHEDULE_PREWARM', '1') != '0'
+PREWARM_SCVS = [0.1, 0.2, 0.25, 0.3, 0.4, 0.5, 0.6, 0.7, 0.75, 0.8, 0.9, 1.0, 1.1, 1.2, 1.25, 1.5, 2.0]
+
+logger = logging.getLogger(__name__)
+
+# default inputs of the layout
+DEFAULTS = {'omega': 0.5, 'n': 5, 'means': 1, 'SCVs': '(0.8,1.0,1.1,0.9,1.0)'}
 
 
 # initial table & figure
-df = pd.DataFrame({r'Client (\(i\))': [''],
-                   r'Interarrival time (\(x_i\))': ['Computing appointment schedule...'],
-                   r'Arrival time (\(t_i\))': ['']})
-df = df.to_dict('records')
+df = [{r'Client (\(i\))': '',
+       r'Interarrival time (\(x_i\))': 'Computing appointment schedule...',
+       r'Arrival time (\(t_i\))': ''}]
 
 no_fig = {
     'layout': {
@@ -36,10 +51,44 @@ app = dash.Dash(__name__, external_scripts=['https://cdn.jsdelivr.net/npm/mathja
 app.title = 'Adaptive Schedule'
 server = app.server
 
+
+@server.route('/metrics')
+def metrics():
+    """
+    Prometheus endpoint with the cumulative stage timings and counters.
+    """
+
+    return Response(default_store().render(), mimetype='text/plain; version=0.0.4')
+
+
+@server.route('/api/schedule', methods=['POST'])
+def api_schedule():
+    """
+    JSON endpoint that takes the inputs of the app (omega, n, means,
+    SCVs, k, u, fixed_t, tau) and returns the optimal arrival times
+    and cost, without rendering any table or figure.
+    """
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify(error='Error! Expected a JSON object.'), 400
+
+    try:
+        params = validate(*[data.get(key) for key in PARAMETERS])
+    except ParameterError as e:
+        return jsonify(error=str(e)), 400
+
+    try:
+        return jsonify(compute(params))
+    except ParameterError as e:  # no finite solution
+        return jsonify(error=str(e)), 422
+
+
 def app_layout():
 
     app_layout = html.Div(id='main',children=[
-        dcc.Interval(id='interval-updating-graphs', interval=1000, n_intervals=0),
+        dcc.Interval(id='interval-updating-graphs', interval=1000, n_intervals=0, disabled=True),
+        dcc.Store(id='job'),
         html.Div(
             className='container',
             children=[
@@ -67,23 +116,23 @@ def app_layout():
                             # Body
                             [html.Tr([html.Th('Schedule Characteristics'),
                                 html.Td(r'\(\omega\)'),
-                                dcc.Input(id='omega', min=0.001, max=0.999, type='number', value=0.5, placeholder="e.g. '0.5'"),
+                                dcc.Input(id='omega', min=0.001, max=0.999, type='number', value=DEFAULTS['omega'], placeholder="e.g. '0.5'"),
                                 html.Td(r'\((0,1)\)'),
                                 html.Td('idle : waiting time')])] +
                             [html.Tr([html.Td(''),
                                 html.Td(r'\(n\)'),
-                                dcc.Input(id='n', min=1, max=20, step=1, type='number', value=5, placeholder="e.g. '5'"),
+                                dcc.Input(id='n', min=1, max=20, step=1, type='number', value=DEFAULTS['n'], placeholder="e.g. '5'"),
                                 html.Td(r'\(\mathbb{N}_{\leq 20}\)'),
                                 html.Td('#clients to serve')])] +
 
                             [html.Tr([html.Th('Client Characteristics'),
                                 html.Td(r'\(\mathbb{E}B_i\)'),
-                                html.Div(dcc.Input(id='means', type='text', value=1, placeholder="e.g. '1' or '(1,1,1,1,1)'")),
+                                html.Div(dcc.Input(id='means', type='text', value=DEFAULTS['means'], placeholder="e.g. '1' or '(1,1,1,1,1)'")),
                                 html.Td(r'\((0,\infty)^n\)'),
                                 html.Td('mean(s)')])] +
                             [html.Tr([html.Td(''),
                                 html.Td(r'\(\mathbb{S}(B_i)\)'),
-                                html.Div(dcc.Input(id='SCVs', type='text', value='(0.8,1.0,1.1,0.9,1.0)', placeholder="e.g. '(0.8,1.0,1.1,0.9,1.0)'")),
+                                html.Div(dcc.Input(id='SCVs', type='text', value=DEFAULTS['SCVs'], placeholder="e.g. '(0.8,1.0,1.1,0.9,1.0)'")),
                                 html.Td(r'\((0,\infty)^n\)'),
                                 html.Td('SCV(s)')])] +
 
@@ -170,138 +219,155 @@ def update_click_output(button_click, close_click):
         return {'display': 'none'}
 
 
+def schedule_output(t, cost, n, k, fixed_t, header=None, title='Optimal interarrival times'):
+    """
+    Returns the table columns, table data and figure of a schedule.
+    """
+
+    inter_t = [t[0]] + list(np.diff(t))
+    clients = list(range(n+1-len(t),n+1))
+    df = [{r'Client (\(i\))': i,
+           r'Interarrival time (\(x_i\))': f'{np.round(x,4):.4f}',
+           r'Arrival time (\(t_i\))': f'{np.round(t_i,4):.4f}'} for i, x, t_i in zip(clients, inter_t, t)]
+
+    figure = go.Figure(data=[go.Scatter(x=clients, y=inter_t, marker={'color': '#242582'},
+        showlegend=False, name='Interarrival time')],
+        layout=go.Layout(
+            title=go.layout.Title(text=title, x=0.5, xanchor='center'), # Plotly 4
+            xaxis={'title': 'Client', 'tick0': 1, 'dtick': 1},
+            yaxis={'title': 'Interarrival time'},
+            paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)'))
+
+    m = len(fixed_t)
+    if m:
+        figure.add_trace(go.Scatter(x=list(range(k+1,k+m+1)), y=inter_t[:m], marker=dict(
+            color='#dce9f9'),
+            showlegend=False,
+            name='Fixed interarrival time'
+        ))
+
+    header = header or f'Appointment Schedule (Cost: {cost:.4f})'
+    columns = [{'name': [header, k], 'id': k} for k in df[0]]
+
+    return columns, df, figure
+
+
+def message_output(message, title):
+    """
+    Returns the table columns, table data and (empty) figure of a message.
+    """
+
+    df = [{r'Client (\(i\))': '',
+           r'Interarrival time (\(x_i\))': message,
+           r'Arrival time (\(t_i\))': ''}]
+
+    figure = go.Figure(data=[go.Scatter(x=[0], y=[0], marker={'color': 'rgba(0,0,0,0)'})],
+        layout= {
+            'xaxis': {'visible': False},
+            'yaxis': {'visible': False},
+            'paper_bgcolor': 'rgba(0,0,0,0)',
+            'plot_bgcolor': 'rgba(0,0,0,0)'
+       })
+    figure.update_layout(title=title)
+    columns = [{'name': [f'Appointment Schedule', k], 'id': k} for k in df[0]]
+
+    return columns, df, figure
+
+
 # schedule & graph
 @app.callback(
-    [Output('schedule_df', 'columns'), Output('schedule_df', 'data'), Output('graph_df', 'figure')],
-    [Input('submit-button', 'n_clicks')],
+    [Output('schedule_df', 'columns'), Output('schedule_df', 'data'), Output('graph_df', 'figure'), Output('job', 'data'),
+     Output('interval-updating-graphs', 'disabled')],
+    [Input('submit-button', 'n_clicks'), Input('interval-updating-graphs', 'n_intervals')],
     [State('omega', 'value'), State('n', 'value'),
      State('means', 'value'), State('SCVs', 'value'),
      State('k', 'value'), State('u', 'value'),
-     State('fixed_t', 'value'), State('tau', 'value')],
+     State('fixed_t', 'value'), State('tau', 'value'),
+     State('job', 'data')],
 )
-def updateTable(n_clicks, omega, n, means, SCVs, k, u, fixed_t, tau):
+def updateTable(n_clicks, n_intervals, omega, n, means, SCVs, k, u, fixed_t, tau, job):
 
-    error = None
-    try:
-        means = eval(str(means), {'__builtins__': {}})
-    except:
-        error = 'Error! No means entered.'
-    try:
-        SCVs = eval(str(SCVs), {'__builtins__': {}})
-    except:
-        error = 'Error! No SCVs entered.'
-
-    if type(means) == float or type(means) == int:
-        means = [means] * n
-    if type(SCVs) == float or type(SCVs) == int:
-        SCVs = [SCVs] * n
-    if len(means) != n:
-        error = 'Error! Not enough means entered.'
-    elif len(SCVs) != n:
-        error = 'Error! Not enough SCVs entered.'
-
-    if not k:
-        k = 0
-    if not u:
-        u = 0
-    if not tau:
-        tau = 0
-    
-    if k >= n:
-        error = r'Error! Note that \(k < n\).'
-    elif k == 0 and u > 0:
-        error = r'Error! Note that \(u > 0 \implies k > 0\).'
+    ctx = dash.callback_context
+    if ctx.triggered and ctx.triggered[0]['prop_id'] == 'interval-updating-graphs.n_intervals':
+        if not job or job['done']:  # nothing to poll
+            raise PreventUpdate
+        return polling(poll_job(job))
 
     try:
-        fixed_t = eval(str(fixed_t), {'__builtins__': {}})
-
-        if not fixed_t:
-            fixed_t = []
-        else:
-            if type(fixed_t) == float or type(fixed_t) == int:
-                fixed_t = np.array([fixed_t])
-            else:
-                fixed_t = np.array(fixed_t)
-
-            if len(fixed_t) > 1 and not all(i < j for i, j in zip(fixed_t, fixed_t[1:])):
-                error = r'Error! Note that the fixed arrival times must be increasing.'
-            elif len(fixed_t) >= n-k:
-                error = r'Error! Note that \(\ell < n\).'
-            elif len(fixed_t) and tau < fixed_t[-1]:
-                error = r'Error! Note that \(\tau \geq t_\ell\).'
-    except:
-        error = f'Error! Wrongly entered fixed arrival times.'
-
-    if error:  # error handling
-        df = pd.DataFrame({r'Client (\(i\))': [''],
-                   r'Interarrival time (\(x_i\))': [error],
-                   r'Arrival time (\(t_i\))': ['']})
-
-        figure = go.Figure(data=[go.Scatter(x=[0], y=[0], marker={'color': 'rgba(0,0,0,0)'})],
-            layout= {
-                'xaxis': {'visible': False},
-                'yaxis': {'visible': False},
-                'paper_bgcolor': 'rgba(0,0,0,0)',
-                'plot_bgcolor': 'rgba(0,0,0,0)'
-           })
-        figure.update_layout(title=r'Please enter the correct parameters.')
-        columns = [{'name': [f'Appointment Schedule', k], 'id': k} for k in df.keys()]
+        params = validate(omega, n, means, SCVs, k, u, fixed_t, tau)
+    except ParameterError as e:  # error handling
+        return polling((*message_output(str(e), r'Please enter the correct parameters.'), None))
+
+    # the schedule is computed in the background, after which it is shifted by t_shift
+    spec = problem(**params)
+    logger.debug('case %d', spec['case'])
+    job_id = default_queue().submit(*spec['args'])
+    job = {'id': job_id, 'n': params['n'], 'k': params['k'], 'fixed_t': params['fixed_t'],
+           'idle': spec['args'][5:] == (1,0), 'fixed_inter_times': spec['args'][3],
+           't_shift': spec['t_shift'], 'cost_shift': spec['cost_shift'], 'done': False}
+
+    return polling(poll_job(job))
+
+
+def polling(outputs):
+    """
+    Appends to the outputs of updateTable whether the interval is
+    disabled, such that the browser only polls while a job is in flight.
+    """
+
+    job = outputs[-1]
+    return (*outputs, not job or job['done'])
 
-    else:
-        if not k and not u:  # system is idle
-            if not len(fixed_t):
-                print('Case 1')
-                t, cost = Schedule(means,SCVs,omega,[],0,k=1,u=0)
-                t += tau
-                cost += omega * tau
-            else:
-                print('Case 2')
-                min_time_next = tau - fixed_t[-1]
-                fixed_inter_times = [(fixed_t[i] - fixed_t[i-1]) for i in range(1,len(fixed_t))]
-                print(fixed_inter_times, min_time_next)
-                t, cost = Schedule(means,SCVs,omega,fixed_inter_times,min_time_next,k=1,u=0)
-                print(t)
-                t += fixed_t[0]
-                cost += omega * fixed_t[0]
-
-        else:  # a client is in service
-            if not len(fixed_t):
-                print('Case 3')
-                t, cost = Schedule(means,SCVs,omega,[],tau,k,u)
-            else:
-                print('Case 4')
-                min_time_next = tau - fixed_t[-1]
-                fixed_inter_times = [fixed_t[0]] + [(fixed_t[i] - fixed_t[i-1]) for i in range(1,len(fixed_t))]
-                t, cost = Schedule(means,SCVs,omega,fixed_inter_times,min_time_next,k,u)
-
-
-        inter_t = [t[0]] + list(np.diff(t))
-        df = pd.DataFrame({r'Client (\(i\))': list(np.arange(n+1-len(t),n+1)),
-            r'Interarrival time (\(x_i\))': [f'{np.round(i,4):.4f}' for i in inter_t],
-            r'Arrival time (\(t_i\))': [f'{np.round(i,4):.4f}' for i in t]})
-
-        figure = go.Figure(data=[go.Scatter(x=df.iloc[:,0], y=inter_t, marker={'color': '#242582'},
-            showlegend=False, name='Interarrival time')],
-            layout=go.Layout(
-                title=go.layout.Title(text='Optimal interarrival times', x=0.5, xanchor='center'), # Plotly 4
-                xaxis={'title': 'Client', 'tick0': 1, 'dtick': 1},
-                yaxis={'title': 'Interarrival time'},
-                paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)'))
-
-        m = len(fixed_t)
-        if m:
-            figure.add_trace(go.Scatter(x=list(range(k+1,k+m+1)), y=inter_t[:m], marker=dict(
-                color='#dce9f9'),
-                showlegend=False,
-                name='Fixed interarrival time'
-            ))
-
-        columns = [{'name': [f'Appointment Schedule (Cost: {cost:.4f})', k], 'id': k} for k in df.columns]
-
-    return columns, df.to_dict('records'), figure
+
+def poll_job(job):
+    """
+    Returns the outputs of updateTable given the state of a background job.
+    """
+
+    status = default_queue().status(job['id'])
+
+    if status is None or status['status'] == 'failed':
+        job['done'] = True
+        return (*message_output('Error! The appointment schedule could not be computed.',
+                                r'Please try again.'), job)
+
+    if status['status'] == 'done':
+        job['done'] = True
+        t = np.array(status['schedule']) + job['t_shift']
+        cost = status['cost'] + job['cost_shift']
+        return (*schedule_output(t, cost, job['n'], job['k'], job['fixed_t']), job)
+
+    if status['x'] is None:  # no iterate yet
+        return (*message_output('Computing appointment schedule...', r'Computing...'), job)
+
+    # current iterate of the optimizer
+    inter_times = job['fixed_inter_times'] + status['x']
+    if job['idle']:
+        inter_times = [0] + inter_times
+    t = np.cumsum(inter_times) + job['t_shift']
+    cost = status['cost'] + job['cost_shift']
+    header = f'Computing Appointment Schedule (Iteration {status["iteration"]}, Cost: {cost:.4f})'
+
+    return (*schedule_output(t, cost, job['n'], job['k'], job['fixed_t'], header, 'Current interarrival times'), job)
+
+
+def prewarm():
+    """
+    Computes (or loads from the schedule cache) the schedule of the
+    default inputs, which the layout requests on page load, and the
+    phase fits of common SCVs. With gunicorn --preload, this runs once
+    in the master process and the workers inherit the warm caches.
+    """
+
+    spec = problem(**validate(**DEFAULTS))
+    cached_schedule(*spec['args'])
+    warm_phase_fits(PREWARM_SCVS)
 
 
 app.layout = app_layout
 
+if PREWARM:
+    prewarm()
+
 if __name__ == '__main__':
     app.run_server()
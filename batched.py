@@ -0,0 +1,214 @@
+import math
+import numpy as np
+
+from scipy.optimize import minimize
+
+from kernels import poisson_pmf
+
+
+def batched_phase_parameters(means, SCV, u):
+    """
+    Vectorized version of phase_parameters for a stack of means and
+    elapsed service times u that share the same SCV, and hence the
+    same number of phases. Returns gamma of shape (B,d) and T of
+    shape (B,d,d).
+    """
+
+    means = np.asarray(means, dtype=float)
+    u = np.broadcast_to(np.asarray(u, dtype=float), means.shape)
+
+    # weighted Erlang case
+    if SCV < 1:
+
+        # parameters
+        K = math.floor(1/SCV)
+        p = ((K + 1) * SCV - math.sqrt((K + 1) * (1 - K * SCV))) / (SCV + 1)
+        mu = (K + 1 - p) / means
+
+        # initial distribution
+        z = np.arange(K+1)
+        P = poisson_pmf(K, mu*u)
+        B_sf = np.sum(P[:,:K], axis=1) + (1 - p) * P[:,K]
+        gamma = P / B_sf[:,None]
+        gamma[:,K] *= (1 - p)
+
+        # transition rate matrices
+        T = -mu[:,None,None] * np.eye(K+1)
+        T[:,z[:-2],z[1:-1]] = mu[:,None]
+        T[:,K-1,K] = (1 - p) * mu
+
+    # hyperexponential case
+    else:
+
+        # parameters
+        p = (1 + np.sqrt((SCV - 1) / (SCV + 1))) / 2
+        mu1 = 2 * p / means
+        mu2 = 2 * (1 - p) / means
+
+        # initial distribution
+        gamma = np.zeros((len(means),2))
+        B_sf = p * np.exp(-mu1 * u) + (1 - p) * np.exp(-mu2 * u)
+        gamma[:,0] = p * np.exp(-mu1 * u) / B_sf
+        gamma[:,1] = 1 - gamma[:,0]
+
+        # transition rate matrices
+        T = np.zeros((len(means),2,2))
+        T[:,0,0] = -mu1
+        T[:,1,1] = -mu2
+
+    return gamma, T
+
+
+def batched_Vn(gamma, T):
+    """
+    Creates the stack of matrices Vn of shape (B,D,D) given the
+    per-client stacks of initial distributions and transition matrices.
+    """
+
+    n = len(T)
+    d = [T_i.shape[1] for T_i in T]
+    D = np.cumsum([0] + d)
+    Vn = np.zeros((T[0].shape[0], D[n], D[n]))
+
+    for i in range(n):
+        Vn[:, D[i]:D[i+1], D[i]:D[i+1]] = T[i]
+        if i < n - 1:
+            exits = -np.sum(T[i], axis=2)
+            Vn[:, D[i]:D[i+1], D[i+1]:D[i+2]] = exits[:,:,None] * gamma[i+1][:,None,:]
+
+    return Vn
+
+
+def batched_sojourn_vectors(gamma, T):
+    """
+    Returns, for every client i, the stack of vectors -inv(Vn_i) @ 1
+    of shape (B,D_i) by block back substitution (cf. BlockBidiagonal).
+    """
+
+    n = len(T)
+    h = [-np.linalg.solve(T_i, np.ones(T_i.shape[:2] + (1,)))[:,:,0] for T_i in T]  # -inv(T_i) @ 1
+
+    Z = []
+    for i in range(n):
+        parts = [h[i]]
+        for j in range(i - 1, -1, -1):
+            s = np.sum(gamma[j+1] * parts[-1], axis=1)
+            parts.append(h[j] + s[:,None])
+        Z.append(np.concatenate(parts[::-1], axis=1))
+
+    return Z
+
+
+def batched_expm(A, order=16):
+    """
+    Returns the matrix exponentials of a stack of matrices A
+    of shape (B,d,d) by scaling and squaring of a Taylor series.
+    """
+
+    norm = np.max(np.sum(np.abs(A), axis=2))
+    s = max(0, math.ceil(math.log2(norm / 0.5))) if norm > 0 else 0
+    A = A / 2**s
+
+    E = np.broadcast_to(np.eye(A.shape[1]), A.shape).copy()
+    term = E.copy()
+    for j in range(1, order + 1):
+        term = term @ A / j
+        E += term
+
+    for _ in range(s):
+        E = E @ E
+
+    return E
+
+
+def batched_cost_and_gradient(X, EB, gamma, Vn, Z, omega, k, fixed_inter_times):
+    """
+    Evaluates the cost function and its gradient (cf. cost_and_gradient)
+    for a stack of B problems at once. X has shape (B,N-k-m), EB shape
+    (B,N), omega shape (B,) and fixed_inter_times shape (B,m).
+    """
+
+    B, m = fixed_inter_times.shape
+    x = np.concatenate((np.zeros((B,k)), fixed_inter_times, X), axis=1)
+
+    n = len(gamma)  # total number of clients
+    D = np.cumsum([gamma_i.shape[1] for gamma_i in gamma])
+
+    G = [0] * n
+    P = [0] * (n - 1)
+    E = [0] * (n - 1)
+
+    # forward pass
+    G[0] = gamma[0]
+    for i in range(1, n):
+        E[i-1] = batched_expm(Vn[:, :D[i-1], :D[i-1]] * x[:,i,None,None])
+        P[i-1] = np.einsum('bd,bde->be', G[i-1], E[i-1])
+        F = 1 - np.sum(P[i-1], axis=1)
+        G[i] = np.concatenate((P[i-1], gamma[i] * F[:,None]), axis=1)
+
+    ES = np.stack([np.sum(G[i] * Z[i], axis=1) for i in range(n)], axis=1)
+    EW = ES[:,1:] - EB[:,1:]
+    EI = x[:,1:] + EW - ES[:,:-1]
+    costs = omega * np.sum(EI, axis=1) + (1 - omega) * np.sum(EW, axis=1)
+
+    # cost = omega * sum(x) + sum(c[i] * ES[i]) + constant
+    c = np.zeros((B,n))
+    c[:,1:] += 1
+    c[:,:-1] -= omega[:,None]
+
+    # backward pass
+    grad = np.zeros((B,n))
+    G_bar = c[:,n-1,None] * Z[n-1]
+    for i in range(n - 1, 0, -1):
+        d = D[i-1]
+        P_bar = G_bar[:,:d] - np.sum(G_bar[:,d:] * gamma[i], axis=1)[:,None]
+        AP_bar = np.einsum('bde,be->bd', Vn[:, :d, :d], P_bar)
+        grad[:,i] = omega + np.sum(P[i-1] * AP_bar, axis=1)
+        G_bar = c[:,i-1,None] * Z[i-1] + np.einsum('bde,be->bd', E[i-1], P_bar)
+
+    return costs, grad[:,k+m:]
+
+
+def batched_optimal_schedule(EB, SCV, omega, fixed_inter_times, tau, k=1, u=0, tol=1e-10):
+    """
+    Computes the optimal schedules (cf. optimal_schedule) of a stack
+    of B problems that share the SCV of every client, but may differ
+    in means EB (shape (B,N)), omega, fixed_inter_times (shape (B,m)),
+    tau and u. The problems are independent, so their total cost is
+    minimized at once with L-BFGS-B under the (plain) lower bounds.
+    """
+
+    EB = np.atleast_2d(np.asarray(EB, dtype=float))
+    B, N = EB.shape
+    omega = np.broadcast_to(np.asarray(omega, dtype=float), (B,))
+    tau = np.broadcast_to(np.asarray(tau, dtype=float), (B,))
+    u = np.broadcast_to(np.asarray(u, dtype=float), (B,))
+    fixed_inter_times = np.asarray(fixed_inter_times, dtype=float).reshape(B,-1)
+    m = fixed_inter_times.shape[1]
+    idle = (k == 1) & (u == 0)
+
+    gamma, T = zip(*[batched_phase_parameters(EB[:,i], SCV[i], u if i == 0 else 0) for i in range(N)])
+    Vn = batched_Vn(gamma, T)
+    Z = batched_sojourn_vectors(gamma, T)
+
+    # initial guess and bounds minimization
+    if m:
+        x0 = np.column_stack([tau] + [EB[:,i] for i in range(k+1+m,N)])
+    else:
+        x0 = np.column_stack([EB[:,0] + k] + [EB[:,i] for i in range(k+1,N)])
+    lower_bounds = np.zeros_like(x0)
+    lower_bounds[:,0] = tau
+    bounds = list(zip(lower_bounds.ravel(), [None] * lower_bounds.size))
+
+    def cost_fun(x):
+        costs, grad = batched_cost_and_gradient(x.reshape(x0.shape), EB, gamma, Vn, Z, omega, k, fixed_inter_times)
+        return np.sum(costs), grad.ravel()
+
+    optim = minimize(cost_fun, x0.ravel(), jac=True, bounds=bounds, method='L-BFGS-B', tol=tol)
+    inter_times = optim.x.reshape(x0.shape)
+    costs, _ = batched_cost_and_gradient(inter_times, EB, gamma, Vn, Z, omega, k, fixed_inter_times)
+
+    inter_times = np.concatenate((np.zeros((B,1)), fixed_inter_times, inter_times), axis=1)
+    schedules = [np.cumsum(inter_times[b] if idle[b] else inter_times[b,1:]) for b in range(B)]
+
+    return schedules, costs
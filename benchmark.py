@@ -0,0 +1,299 @@
+import os, sys, json, time, platform, argparse, subprocess, tracemalloc
+import numpy as np
+import scipy
+
+from collections import defaultdict
+
+import adaptive_scheduling as legacy
+from new_adaptive_scheduling import phase_parameters, create_Vn, cost, cost_and_gradient, optimal_schedule
+from solvers import METHODS
+
+
+# benchmark matrix
+N_GRID = [5, 10, 20, 30, 50]
+# SCV 0.15 gives 7 Erlang phases per client, mixed alternates the SCVs (and spreads the means)
+REGIMES = {'erlang': 0.15, 'hyperexp': 2.0, 'mixed': [0.3, 1.5]}
+STATES = {'idle': (1, 0), 'busy': (2, 0.5)}  # (k, u)
+CONSTRAINTS = {'free': ([], 0), 'fixed': ([1.2, 0.8], 0.5)}  # (fixed_inter_times, tau)
+OMEGA = 0.5
+
+RESULTS_DIR = 'benchmark_results'
+REGRESSION_THRESHOLD = 1.25  # slowdown ratio reported by compare
+
+
+def cases(ns=N_GRID):
+    """
+    Yields the benchmark cases as dicts. In the homogeneous regimes,
+    all clients have mean 1, such that the free cases can be compared
+    with the legacy engine.
+    """
+
+    for n in ns:
+        for regime, SCV in REGIMES.items():
+            for state, (k, u) in STATES.items():
+                for constraint, (fixed_inter_times, tau) in CONSTRAINTS.items():
+                    yield {'name': f'n={n}/{regime}/{state}/{constraint}', 'n': n, 'SCV': SCV, 'k': k, 'u': u,
+                           'fixed_inter_times': fixed_inter_times, 'tau': tau}
+
+
+def timeit(f, repeat=5, budget=2.0):
+    """
+    Returns the best and median wall time of f over at most
+    repeat runs, stopping early once the budget (seconds) is spent.
+    """
+
+    times = []
+    start = time.perf_counter()
+    while len(times) < repeat and (not times or time.perf_counter() - start < budget):
+        t = time.perf_counter()
+        f()
+        times.append(time.perf_counter() - t)
+
+    return {'best': min(times), 'median': float(np.median(times)), 'runs': len(times)}
+
+
+def peak_memory(f):
+    """
+    Returns the peak memory (in bytes) allocated while running f.
+    """
+
+    tracemalloc.start()
+    try:
+        f()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(f, repeat, budget):
+
+    result = timeit(f, repeat, budget)
+    result['peak_memory'] = peak_memory(f)
+
+    return result
+
+
+def run_case(case, repeat=5, budget=2.0, optimize_n_max=30, legacy_optimize_n_max=10, solvers=('SLSQP',)):
+    """
+    Times the cost evaluation and the optimization of one case with
+    both engines, and records the differences between their results.
+    The interarrival times all differ and the exponentials that Vn
+    caches by t are cleared before every timed evaluation, such that
+    the kernels are timed rather than cache hits.
+    """
+
+    n, SCV, k, u = case['n'], case['SCV'], case['k'], case['u']
+    fixed_inter_times, tau = case['fixed_inter_times'], case['tau']
+    m = len(fixed_inter_times)
+    homogeneous = not isinstance(SCV, list)
+    if homogeneous:
+        EB, SCVs = [1] * n, [SCV] * n
+    else:
+        EB, SCVs = list(np.linspace(0.8, 1.2, n)), [SCV[i % len(SCV)] for i in range(n)]
+
+    fits = lambda: zip(*[phase_parameters(EB[i], SCVs[i], u if i == 0 else 0) for i in range(n)])
+    gamma, T = fits()
+    Vn_blocks = create_Vn(gamma, T, structured=True)
+    Vn, Vn_sparse = Vn_blocks.todense(), Vn_blocks.tosparse()
+    x = np.array([tau + 1] + list(1.2 + 0.3 * np.sin(np.arange(n - k - m - 1))))
+    args = (x, EB, gamma, Vn, Vn_blocks, OMEGA, k, fixed_inter_times)
+
+    def cold(f):
+        def timed():
+            Vn_blocks.clear_expm()
+            return f()
+        return timed
+
+    timings = {
+        'setup': measure(lambda: create_Vn(*fits(), structured=True).todense(), repeat, budget),
+        'cost': measure(cold(lambda: cost(*args)), repeat, budget),
+        'cost_action': measure(cold(lambda: cost(x, EB, gamma, Vn_sparse, Vn_blocks, OMEGA, k, fixed_inter_times,
+                                                 'action')), repeat, budget),
+        'cost_and_gradient': measure(cold(lambda: cost_and_gradient(*args)), repeat, budget),
+    }
+    values = {'cost': float(cost(*args))}
+    values['cost_action'] = float(cost(x, EB, gamma, Vn_sparse, Vn_blocks, OMEGA, k, fixed_inter_times, 'action'))
+
+    if n <= optimize_n_max:
+        for solver in solvers:
+            result = {}
+            f = lambda: result.update(zip(('schedule', 'cost', 'info'),
+                                          optimal_schedule(EB, SCVs, OMEGA, fixed_inter_times, tau, k, u,
+                                                           full_output=True, solver=solver)))
+            timings[f'optimize[{solver}]'] = measure(f, 1, 0)
+            values[f'optimize[{solver}]'] = float(result['cost'])
+            timings[f'optimize[{solver}]'].update(nit=result['info']['nit'], nfev=result['info']['nfev'])
+
+    # the legacy engine has no fixed interarrival times or heterogeneous clients,
+    # and counts the client in service apart
+    if not m and homogeneous:
+        N, wis = n - 1, k - 1
+        S, alpha_start, alpha = legacy.find_Salpha(1, SCV, u)
+        Sn_inv = legacy.create_Sn(S, alpha_start, alpha, N, structured=True)
+        Sn = Sn_inv.todense()
+
+        timings['legacy_cost'] = measure(lambda: legacy.Transient_EIEW(x, alpha_start, alpha, Sn, Sn_inv,
+                                                                       OMEGA, wis), repeat, budget)
+        values['legacy_cost'] = float(legacy.Transient_EIEW(x, alpha_start, alpha, Sn, Sn_inv, OMEGA, wis))
+
+        if n <= legacy_optimize_n_max:
+            result = {}
+            f = lambda: result.update(fval=legacy.Transient_IA(SCV, u, OMEGA, N, None, wis)[1])
+            timings['legacy_optimize'] = measure(f, 1, 0)
+            values['legacy_optimize'] = float(result['fval'])
+
+    # numerical agreement
+    agreement = {'cost_action': abs(values['cost_action'] - values['cost'])}
+    if 'legacy_cost' in values:
+        agreement['legacy_cost'] = abs(values['legacy_cost'] - values['cost'])
+    if 'legacy_optimize' in values and 'optimize[SLSQP]' in values:
+        agreement['legacy_optimize'] = values['legacy_optimize'] - values['optimize[SLSQP]']  # > 0: new is better
+
+    return {**case, 'timings': timings, 'values': values, 'agreement': agreement}
+
+
+def metadata():
+
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = None
+
+    return {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'commit': commit, 'python': platform.python_version(),
+            'numpy': np.__version__, 'scipy': scipy.__version__, 'platform': platform.platform(),
+            'processor': platform.processor(), 'cpus': os.cpu_count()}
+
+
+def solver_table(results):
+    """
+    Returns the fastest solver per number of free variables as a
+    table for solvers.select_method, e.g. {"10": "SLSQP", "inf":
+    "L-BFGS-B"}, where consecutive sizes with the same solver merge.
+    """
+
+    times = defaultdict(lambda: defaultdict(list))
+    for result in results:
+        size = result['n'] - result['k'] - len(result['fixed_inter_times'])
+        for name, timing in result['timings'].items():
+            if name.startswith('optimize['):
+                times[size][name[9:-1]].append(timing['median'])
+
+    fastest = [(size, min(times[size], key=lambda s: np.median(times[size][s]))) for size in sorted(times)]
+    table = {}
+    for (size, solver), following in zip(fastest, fastest[1:] + [(float('inf'), None)]):
+        if solver != following[1]:
+            table[str(size) if following[1] else 'inf'] = solver
+
+    return table
+
+
+def report(results, file=sys.stdout):
+
+    print(f"{'case':<32} {'cost':>9} {'action':>9} {'grad':>9} {'legacy':>9} {'optimize':>9} "
+          f"{'peak MB':>8} {'|diff|':>9}", file=file)
+    for result in results:
+        t = result['timings']
+        fmt = lambda name: f"{t[name]['median']:9.4f}" if name in t else f"{'-':>9}"
+        optimize = next((name for name in t if name.startswith('optimize[')), '')
+        peak = max(timing['peak_memory'] for timing in t.values()) / 2**20
+        diff = max([abs(v) for k, v in result['agreement'].items() if k != 'legacy_optimize'])
+        print(f"{result['name']:<32} {fmt('cost')} {fmt('cost_action')} {fmt('cost_and_gradient')} "
+              f"{fmt('legacy_cost')} {fmt(optimize)} {peak:8.2f} {diff:9.2e}", file=file)
+
+
+def compare(old_path, new_path, threshold=REGRESSION_THRESHOLD, file=sys.stdout):
+    """
+    Prints the ratios of the median times of two stored runs and
+    returns the number of timings that slowed down by more than
+    threshold.
+    """
+
+    with open(old_path) as f:
+        old = {result['name']: result for result in json.load(f)['results']}
+    with open(new_path) as f:
+        new = json.load(f)['results']
+
+    regressions = 0
+    print(f"{'case':<32} {'timing':<22} {'old':>9} {'new':>9} {'ratio':>7}", file=file)
+    for result in new:
+        if result['name'] not in old:
+            continue
+        for name, timing in result['timings'].items():
+            before = old[result['name']]['timings'].get(name)
+            if before is None:
+                continue
+            ratio = timing['median'] / before['median']
+            flag = ''
+            if ratio > threshold:
+                flag = '  slower'
+                regressions += 1
+            elif ratio < 1 / threshold:
+                flag = '  faster'
+            print(f"{result['name']:<32} {name:<22} {before['median']:9.4f} {timing['median']:9.4f} "
+                  f"{ratio:7.2f}{flag}", file=file)
+
+    return regressions
+
+
+def run(ns=N_GRID, repeat=5, budget=2.0, optimize_n_max=30, legacy_optimize_n_max=10, solvers=('SLSQP',),
+        output=None, table=None, quiet=False):
+    """
+    Runs all cases, stores the results with the environment metadata
+    as JSON in output (by default a timestamped file in RESULTS_DIR),
+    and optionally writes the solver table.
+    """
+
+    results = []
+    for case in cases(ns):
+        if not quiet:
+            print(case['name'], file=sys.stderr)
+        results.append(run_case(case, repeat, budget, optimize_n_max, legacy_optimize_n_max, solvers))
+
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, time.strftime('%Y%m%d-%H%M%S') + '.json')
+    with open(output, 'w') as f:
+        json.dump({'metadata': metadata(), 'results': results}, f, indent=1)
+
+    if table is not None:
+        with open(table, 'w') as f:
+            json.dump(solver_table(results), f)
+
+    if not quiet:
+        report(results)
+        print(f'results written to {output}', file=sys.stderr)
+
+    return results
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmarks the scheduling engines.')
+    subparsers = parser.add_subparsers(dest='command')
+
+    run_parser = subparsers.add_parser('run', help='run the benchmark suite')
+    run_parser.add_argument('--n', type=int, nargs='+', default=N_GRID)
+    run_parser.add_argument('--repeat', type=int, default=5)
+    run_parser.add_argument('--budget', type=float, default=2.0, help='seconds per timing')
+    run_parser.add_argument('--optimize-n-max', type=int, default=30)
+    run_parser.add_argument('--legacy-optimize-n-max', type=int, default=10)
+    run_parser.add_argument('--solvers', nargs='+', default=['SLSQP'], choices=METHODS)
+    run_parser.add_argument('--output', help='results file (JSON)')
+    run_parser.add_argument('--solver-table', help='write the fastest solver per size for SCHEDULE_SOLVER_TABLE')
+
+    compare_parser = subparsers.add_parser('compare', help='compare two stored runs')
+    compare_parser.add_argument('old')
+    compare_parser.add_argument('new')
+    compare_parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD)
+
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        sys.exit(1 if compare(args.old, args.new, args.threshold) else 0)
+
+    if args.command == 'run':
+        run(args.n, args.repeat, args.budget, args.optimize_n_max, args.legacy_optimize_n_max, args.solvers,
+            args.output, args.solver_table)
+    else:
+        parser.print_help()
@@ -0,0 +1,218 @@
+import os, csv, sys, json, time, argparse
+
+from concurrent.futures import wait, FIRST_COMPLETED
+from contextlib import nullcontext
+from functools import partial, lru_cache
+
+from api import PARAMETERS, ParameterError, validate, problem, result
+from new_adaptive_scheduling import optimal_schedule
+from parallel import make_executor
+import metrics  # instrumentation
+
+
+CSV_FIELDS = ('id', 'case', 'cost', 'clients', 'arrival_times', 'error')
+PENDING_PER_WORKER = 4  # problems in flight per worker, which bounds the memory
+# metrics of batch runs are kept apart from those of the web server (not recorded if unset)
+BULK_METRICS_PATH = os.environ.get('SCHEDULE_BULK_METRICS_PATH')
+
+
+def read_problems(path):
+    """
+    Yields (id, params) for every problem of a CSV file (with a header
+    holding PARAMETERS, as entered in the app, and optionally id) or a
+    JSONL file (one object with these keys per line), reading one line
+    at a time. Problems without an id are numbered by their row. The
+    params of a malformed line are None.
+    """
+
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            for i, row in enumerate(csv.DictReader(f), 1):
+                yield row.get('id') or str(i), {p: row.get(p) for p in PARAMETERS}
+            return
+
+        for i, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                yield str(i), None
+                continue
+            if not isinstance(row, dict):
+                yield str(i), None
+                continue
+            yield str(row.get('id', i)), {p: row.get(p) for p in PARAMETERS}
+
+
+@lru_cache(maxsize=None)
+def _store(path):
+
+    return metrics.MetricsStore(path)
+
+
+def solve(row_id, params, metrics_path=BULK_METRICS_PATH, **kwargs):
+    """
+    Computes the optimal schedule of one problem (kwargs are passed to
+    optimal_schedule) and returns it in the format of api.compute, or
+    the error. Its metrics are added to the store at metrics_path, if
+    given.
+    """
+
+    try:
+        if params is None:
+            raise ParameterError('Error! Malformed line.')
+        params = validate(**params)
+    except ParameterError as e:
+        return {'id': row_id, 'error': str(e)}
+
+    spec = problem(**params)
+    record = metrics.request('bulk', _store(metrics_path)) if metrics_path else nullcontext()
+    try:
+        with record:
+            schedule, cost = optimal_schedule(*spec['args'], **kwargs)
+        return {'id': row_id, **result(params, spec, schedule, cost)}
+    except ParameterError as e:
+        return {'id': row_id, 'error': str(e)}
+    except Exception as e:
+        return {'id': row_id, 'error': f'{type(e).__name__}: {e}'}
+
+
+def completed_ids(path):
+    """
+    Returns the ids of the results in the output file path, after
+    removing a partially written last line (e.g. of an interrupted run),
+    such that the run can be resumed by appending to it.
+    """
+
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, 'rb+') as f:
+        end = pos = f.seek(0, os.SEEK_END)
+        while pos > 0:  # find the end of the last complete line
+            start = max(pos - 4096, 0)
+            f.seek(start)
+            newline = f.read(pos - start).rfind(b'\n')
+            if newline >= 0:
+                pos = start + newline + 1
+                break
+            pos = start
+        if pos < end:
+            f.truncate(pos)
+
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            return {row['id'] for row in csv.DictReader(f)}
+        return {str(json.loads(line)['id']) for line in f if line.strip()}
+
+
+def _writer(f, path):
+    """
+    Returns a function that appends one result to the open output file
+    f as a line of JSON or CSV, and flushes it.
+    """
+
+    if not path.endswith('.csv'):
+        def write(output):
+            f.write(json.dumps(output) + '\n')
+            f.flush()
+        return write
+
+    writer = csv.DictWriter(f, CSV_FIELDS, lineterminator='\n')
+    if f.tell() == 0:
+        writer.writeheader()
+
+    def write(output):
+        row = dict(output)
+        for key in ('clients', 'arrival_times'):
+            if key in row:
+                row[key] = json.dumps(row[key])
+        writer.writerow(row)
+        f.flush()
+
+    return write
+
+
+def run(input_path, output_path, processes=None, pending=None, progress=None, metrics_path=BULK_METRICS_PATH,
+        **kwargs):
+    """
+    Solves all problems of input_path (see read_problems) that are not
+    yet in output_path, in a pool of processes (inline if processes is
+    0), and appends the results to output_path (JSONL, or CSV if it ends
+    with .csv) in order of completion. At most pending problems (by
+    default PENDING_PER_WORKER per worker) are read ahead, so the memory
+    does not grow with the input. The output file is the checkpoint: an
+    interrupted run continues where it stopped when started again.
+    Calls progress(stats) after every result, if given, and records
+    the metrics in metrics_path, if given (see solve). Returns the
+    numbers of solved, failed and skipped (already solved) problems.
+    """
+
+    done = completed_ids(output_path)
+    stats = {'solved': 0, 'failed': 0, 'skipped': 0}
+    task = partial(solve, metrics_path=metrics_path, **kwargs)
+
+    def problems():
+        for row_id, params in read_problems(input_path):
+            if row_id in done:
+                stats['skipped'] += 1
+            else:
+                yield row_id, params
+
+    with open(output_path, 'a', newline='') as f:
+        write = _writer(f, output_path)
+
+        def record(output):
+            write(output)
+            stats['failed' if 'error' in output else 'solved'] += 1
+            if progress is not None:
+                progress(stats)
+
+        if processes == 0:
+            for row_id, params in problems():
+                record(task(row_id, params))
+            return stats
+
+        workers = processes or os.cpu_count() or 1
+        limit = pending or PENDING_PER_WORKER * workers
+        in_flight = set()
+
+        with make_executor('process', workers) as executor:
+            for row_id, params in problems():
+                in_flight.add(executor.submit(task, row_id, params))
+                if len(in_flight) >= limit:
+                    finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        record(future.result())
+
+            while in_flight:
+                finished, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    record(future.result())
+
+    return stats
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Computes the optimal schedules of a CSV or JSONL file of problems.')
+    parser.add_argument('input', help='problems (.csv with a header, or .jsonl)')
+    parser.add_argument('output', help='results (.csv or .jsonl), resumed if it exists')
+    parser.add_argument('--processes', type=int, default=None, help='number of worker processes (0: inline)')
+    parser.add_argument('--pending', type=int, default=None, help='maximum number of problems in flight')
+    parser.add_argument('--solver', default='SLSQP')
+    parser.add_argument('--precision', choices=['adaptive'], default=None)
+    parser.add_argument('--metrics', default=BULK_METRICS_PATH, help='SQLite file of the metrics (default: none)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    def progress(stats, every=100):
+        if (stats['solved'] + stats['failed']) % every == 0:
+            print(f"{stats['solved']} solved, {stats['failed']} failed ({time.perf_counter() - start:.1f}s)",
+                  file=sys.stderr)
+
+    stats = run(args.input, args.output, args.processes, args.pending, progress, args.metrics, solver=args.solver,
+                precision=args.precision)
+    print(f"{stats['solved']} solved, {stats['failed']} failed, {stats['skipped']} skipped "
+          f"({time.perf_counter() - start:.1f}s)", file=sys.stderr)
@@ -0,0 +1,92 @@
+import argparse
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from new_adaptive_scheduling import ScheduleProblem, PRECISION_STAGES, _optimize, initial_guess, to_schedule
+
+
+def _trace(problem, omegas, x0, lower_bounds, stages, solver, tol, maxiter):
+    """
+    Solves the problem for the increasing weights omegas, warm-starting
+    every solve from the optima of the previous weights (extrapolated
+    linearly from the last two, a secant predictor). Returns the
+    free interarrival times, the cost and the total expected idle and
+    waiting times at every weight.
+    """
+
+    x = np.full((len(omegas), len(x0)), np.nan)
+    cost, EI, EW = np.full(len(omegas), np.nan), np.full(len(omegas), np.nan), np.full(len(omegas), np.nan)
+
+    for j, omega in enumerate(omegas):
+        if j > 1 and omegas[j-1] > omegas[j-2]:  # secant predictor
+            x0 = x[j-1] + (x[j-1] - x[j-2]) * (omega - omegas[j-1]) / (omegas[j-1] - omegas[j-2])
+        weighted = problem.with_omega(omega)
+        optim, _ = _optimize(weighted, np.maximum(x0, lower_bounds), lower_bounds, stages, solver, tol, maxiter)
+        x[j] = x0 = np.maximum(optim.x, lower_bounds)
+        breakdown = weighted.breakdown(x0)
+        cost[j], EI[j], EW[j] = breakdown['cost'], np.sum(breakdown['EI']), np.sum(breakdown['EW'])
+
+    return x, cost, EI, EW
+
+
+def pareto_frontier(EB, SCV, omegas, fixed_inter_times=[], tau=0, k=1, u=0, method='expm', expm_tol=1e-12,
+                    eps=0, solver='SLSQP', precision=None, maxiter=None, x0=None, processes=None):
+    """
+    Traces the trade-off between the total expected idle time E[I] and
+    the total expected waiting time E[W] of the optimal schedules for
+    the weights omegas (the arguments are those of optimal_schedule).
+    gamma and Vn do not depend on omega, so the problem is set up once,
+    and the weights are solved in increasing order, every solve warm-
+    started from the optima of its neighbours (continuation). If
+    processes > 1, the sorted weights are split into that many
+    contiguous runs, which are traced by a process pool, each run
+    starting from x0 (or the heuristic initial guess).
+    Returns a dict with the weights, schedules (one row per weight),
+    costs, and the totals EI and EW, in the order of omegas.
+    """
+
+    omegas = np.asarray(omegas, dtype=float)
+    order = np.argsort(omegas)
+    N, m = len(EB), len(fixed_inter_times)
+
+    if N == 1 and (k,u) == (1,0) and not m:  # system is idle, one client to schedule
+        zeros = np.zeros(len(omegas))
+        return {'omega': omegas, 'schedule': np.full((len(omegas), 1), float(tau)), 'cost': zeros,
+                'EI': zeros, 'EW': zeros}
+
+    problem = ScheduleProblem.create(EB, SCV, omegas[order[0]], fixed_inter_times, k, u, method, expm_tol, eps)
+
+    x_init, lower_bounds = initial_guess(EB, fixed_inter_times, tau, k)
+    x0 = x_init if x0 is None or len(x0) != len(x_init) else np.maximum(x0, lower_bounds)
+    tol = None if N <= 30 else 1e-4
+    stages = PRECISION_STAGES if precision == 'adaptive' else precision or []
+
+    runs = [run for run in np.array_split(omegas[order], processes or 1) if len(run)]
+    args = [(problem.with_omega(run[0]), run, x0, lower_bounds, stages, solver, tol, maxiter) for run in runs]
+
+    if len(runs) > 1:
+        with ProcessPoolExecutor(len(runs)) as pool:
+            results = list(pool.map(_trace, *zip(*args)))
+    else:
+        results = [_trace(*a) for a in args]
+
+    x, cost, EI, EW = [np.concatenate(r)[np.argsort(order)] for r in zip(*results)]
+    schedules = np.array([to_schedule(x_j, fixed_inter_times, k, u) for x_j in x])
+
+    return {'omega': omegas, 'schedule': schedules, 'cost': cost, 'EI': EI, 'EW': EW}
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Traces the trade-off between idle and waiting times over omega.')
+    parser.add_argument('--EB', type=float, nargs='+', required=True)
+    parser.add_argument('--SCV', type=float, nargs='+', required=True)
+    parser.add_argument('--omega', type=float, nargs='+', default=list(np.round(np.linspace(0.1, 0.9, 9), 2)))
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    frontier = pareto_frontier(args.EB, args.SCV, args.omega, processes=args.processes)
+    print('omega     E[I]      E[W]      cost')
+    for omega, EI, EW, cost in zip(frontier['omega'], frontier['EI'], frontier['EW'], frontier['cost']):
+        print(f'{omega:<9.4f} {EI:<9.4f} {EW:<9.4f} {cost:.4f}')
@@ -0,0 +1,170 @@
+import os, json, time, sqlite3
+import numpy as np
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+
+from schedule_cache import CACHE_PATH, default_cache, cached_schedule
+import metrics  # instrumentation
+
+
+# configuration
+JOBS_WORKERS = int(os.environ.get('SCHEDULE_JOBS_WORKERS', 2))
+JOBS_STALE_AFTER = float(os.environ.get('SCHEDULE_JOBS_STALE_AFTER', 600))  # seconds without progress
+JOBS_MAX_AGE = float(os.environ.get('SCHEDULE_JOBS_MAX_AGE', 24 * 3600))  # seconds
+JOBS_PROGRESS_INTERVAL = 0.2  # seconds between progress updates
+
+
+class JobQueue:
+    """
+    Runs schedule computations in a background thread pool (the expm
+    and BLAS calls release the GIL). The job states, including the
+    current iterate and cost, are kept in an SQLite table, such that
+    any worker process can report on the progress of a job. The job id
+    is the cache key of the parameters, so identical jobs that are in
+    flight are only computed once. Every job records the process that
+    runs it: a job whose process has exited (or that has not progressed
+    for stale_after seconds) is failed when polled, and requeued when
+    submitted again.
+    """
+
+    def __init__(self, path=CACHE_PATH, workers=JOBS_WORKERS, cache=None,
+                 stale_after=JOBS_STALE_AFTER, max_age=JOBS_MAX_AGE):
+
+        self.path = path
+        self.workers = workers
+        self.cache = default_cache() if cache is None else cache
+        self.stale_after = stale_after
+        self.max_age = max_age
+        self.pool = None
+
+        with closing(self._connect()) as con, con:
+            con.execute('CREATE TABLE IF NOT EXISTS jobs (id TEXT PRIMARY KEY, status TEXT, iteration INTEGER, '
+                        'x TEXT, cost REAL, schedule TEXT, error TEXT, updated REAL, owner INTEGER)')
+            if 'owner' not in [row[1] for row in con.execute('PRAGMA table_info(jobs)')]:  # older table
+                con.execute('ALTER TABLE jobs ADD COLUMN owner INTEGER')
+
+    def _connect(self):
+
+        return sqlite3.connect(self.path, timeout=30, isolation_level=None)
+
+    def _update(self, job_id, **fields):
+
+        fields['updated'] = time.time()
+        with closing(self._connect()) as con:
+            con.execute(f"UPDATE jobs SET {', '.join(f'{f} = ?' for f in fields)} WHERE id = ?",
+                        list(fields.values()) + [job_id])
+
+    def submit(self, EB, SCV, omega, fixed_inter_times, tau, k=1, u=0):
+        """
+        Enqueues the computation of optimal_schedule with the given
+        parameters (unless an identical job is in flight or already
+        cached), and returns the job id.
+        """
+
+        job_id = self.cache.normalize(EB, SCV, omega, fixed_inter_times, tau, k, u)[0]
+        hit = self.cache.get(job_id)
+        now = time.time()
+
+        with closing(self._connect()) as con:
+            con.execute('BEGIN IMMEDIATE')
+            con.execute('DELETE FROM jobs WHERE updated < ?', (now - self.max_age,))
+            row = con.execute('SELECT status, updated, owner FROM jobs WHERE id = ?', (job_id,)).fetchone()
+
+            if hit is not None:
+                con.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                            (job_id, 'done', 0, None, hit[1], json.dumps(hit[0].tolist()), None, now, None))
+                con.execute('COMMIT')
+                return job_id
+
+            if row is not None and row[0] in ('queued', 'running') and not self._stale(*row[1:], now):
+                con.execute('COMMIT')  # deduplicated
+                return job_id
+
+            con.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (job_id, 'queued', 0, None, None, None, None, now, os.getpid()))
+            con.execute('COMMIT')
+
+        if self.pool is None:  # created lazily, such that no threads exist before gunicorn forks
+            self.pool = ThreadPoolExecutor(self.workers)
+        self.pool.submit(self._run, job_id, (EB, SCV, omega, fixed_inter_times, tau, k, u))
+
+        return job_id
+
+    def _stale(self, updated, owner, now):
+        """
+        Returns whether a queued or running job is lost: its process
+        (on this host) has exited, or it has not progressed for
+        stale_after seconds.
+        """
+
+        if updated < now - self.stale_after:
+            return True
+        if owner is None or owner == os.getpid():
+            return False
+
+        try:
+            os.kill(owner, 0)  # only checks that the process exists
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+
+        return False
+
+    def _run(self, job_id, args):
+
+        self._update(job_id, status='running')
+        state = {'iteration': 0, 'written': 0}
+
+        def progress(x, cost):
+            state['iteration'] += 1
+            if time.time() - state['written'] > JOBS_PROGRESS_INTERVAL:
+                self._update(job_id, iteration=state['iteration'], x=json.dumps(x.tolist()), cost=float(cost))
+                state['written'] = time.time()
+
+        try:
+            with metrics.request('schedule'):
+                schedule, cost = cached_schedule(*args, cache=self.cache, callback=progress)
+            self._update(job_id, status='done', iteration=state['iteration'], cost=float(cost),
+                         schedule=json.dumps(np.asarray(schedule).tolist()))
+        except Exception as e:
+            self._update(job_id, status='failed', error=repr(e))
+
+    def status(self, job_id):
+        """
+        Returns the state of a job as a dict with keys status ('queued',
+        'running', 'done' or 'failed'), iteration, x (current iterate),
+        cost, schedule (when done) and error, or None if it is unknown.
+        """
+
+        with closing(self._connect()) as con:
+            row = con.execute('SELECT status, iteration, x, cost, schedule, error, updated, owner FROM jobs '
+                              'WHERE id = ?', (job_id,)).fetchone()
+
+        if row is None:
+            return None
+
+        status, iteration, x, cost, schedule, error, updated, owner = row
+        if status in ('queued', 'running') and self._stale(updated, owner, time.time()):
+            status, error = 'failed', 'the worker running the job is gone'
+            with closing(self._connect()) as con:
+                con.execute("UPDATE jobs SET status = ?, error = ?, updated = ? WHERE id = ? "
+                            "AND status IN ('queued', 'running')", (status, error, time.time(), job_id))
+
+        return {'status': status, 'iteration': iteration, 'x': x and json.loads(x), 'cost': cost,
+                'schedule': schedule and json.loads(schedule), 'error': error}
+
+
+_default_queue = None
+
+def default_queue():
+    """
+    Returns the job queue configured through the environment.
+    """
+
+    global _default_queue
+    if _default_queue is None:
+        _default_queue = JobQueue()
+
+    return _default_queue
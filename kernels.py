@@ -0,0 +1,473 @@
+import math, threading
+import numpy as np
+
+from collections import OrderedDict
+from functools import lru_cache
+from scipy.linalg import expm
+
+
+EXPM_CACHE_SIZE = 8  # block sequences of expm kept per matrix (e.g. for zero and fixed interarrival times)
+TOEPLITZ_MIN_STATES = 100  # window size from which toeplitz_expm beats a dense expm (measured crossover)
+
+
+def expm_action(v, A, t, tol=1e-12, theta=30):
+    """
+    Returns v @ expm(A * t) for a row vector (or a matrix of row
+    vectors) v without forming the matrix exponential, by means of
+    uniformization. A must be a (sub)generator, i.e. have non-negative
+    off-diagonal entries, as is the case for Vn and Sn. Every term of
+    the series is non-negative, so the result is accurate up to tol
+    times the 1-norm of v. Each term costs one product with A, so the
+    work per step is O(nnz(A)).
+    """
+
+    from scipy.sparse import csr_matrix, issparse  # deferred, only needed by method='action'
+
+    v = np.asarray(v, dtype=float)
+    if t == 0:
+        return v.copy()
+
+    if not issparse(A):
+        A = csr_matrix(A)
+    A_T = A.T.tocsr()  # w @ A == (A^T @ w^T)^T
+
+    q = max(-A.diagonal().min(), 0)
+    if q == 0:
+        return v.copy()
+
+    # split [0,t] such that the Poisson weights do not underflow
+    steps = max(1, math.ceil(q * t / theta))
+    lam = q * t / steps
+    step_tol = tol / steps
+
+    w = v.T
+    for _ in range(steps):
+
+        weight = math.exp(-lam)
+        mass = weight
+        term = w
+        w = weight * term
+
+        j = 0
+        while 1 - mass > step_tol:
+            j += 1
+            term = term + (A_T @ term) / q
+            weight *= lam / j
+            mass += weight
+            w = w + weight * term
+
+            if weight < step_tol * 1e-3 and j > lam:  # mass lost to rounding
+                break
+
+    return w.T
+
+
+def expm_action_rows(V, A, t, tol=1e-12, theta=30):
+    """
+    Returns the rows V[c] @ expm(A * t[c]) of a stack of row vectors V
+    (shape (C,d)) with their own times t, by uniformization as in
+    expm_action. The terms V @ (I + A/q)^j are shared by all rows, and
+    only their Poisson weights differ, so each term costs one product
+    of A with the whole stack.
+    """
+
+    from scipy.sparse import csr_matrix, issparse
+
+    V = np.asarray(V, dtype=float)
+    t = np.asarray(t, dtype=float)
+    if not issparse(A):
+        A = csr_matrix(A)
+    A_T = A.T.tocsr()
+
+    q = max(-A.diagonal().min(), 0)
+    if q == 0 or not np.max(t) > 0:
+        return V.copy()
+
+    # split [0,max(t)] such that the Poisson weights do not underflow
+    steps = max(1, math.ceil(q * np.max(t) / theta))
+    lam = q * t / steps
+    step_tol = tol / steps
+
+    W = V.T
+    for _ in range(steps):
+
+        weight = np.exp(-lam)
+        mass = weight.copy()
+        term = W
+        W = term * weight
+
+        j = 0
+        while np.any(1 - mass > step_tol):
+            j += 1
+            term = term + (A_T @ term) / q
+            weight = weight * lam / j
+            mass += weight
+            W = W + term * weight
+
+            if np.all((1 - mass <= step_tol) | ((weight < step_tol * 1e-3) & (j > lam))):  # mass lost to rounding
+                break
+
+    return W.T
+
+
+def poisson_pmf(K, lam):
+    """
+    Returns the Poisson(lam) probabilities of 0,...,K, along the last
+    axis if lam is an array (this avoids importing scipy.stats, which
+    dominates the startup time).
+    """
+
+    lam = np.asarray(lam, dtype=float)[...,None]
+    z = np.arange(K + 1)
+    log_factorial = np.concatenate(([0], np.cumsum(np.log(z[1:]))))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        P = np.exp(z * np.log(lam) - lam - log_factorial)
+
+    return np.where(lam == 0, z == 0, P)
+
+
+@lru_cache(maxsize=None)
+def _convolution_pairs(n):
+    """
+    Returns the index pairs (l, j-l) of the block convolution of two
+    sequences of length n, grouped by j, and the start of every group.
+    """
+
+    left = np.concatenate([np.arange(j + 1) for j in range(n)])
+    right = np.concatenate([np.arange(j, -1, -1) for j in range(n)])
+    starts = np.cumsum([0] + list(range(1, n)))
+
+    return left, right, starts
+
+
+def toeplitz_expm(T, C, t, n, theta=1, order=18):
+    """
+    Returns the blocks F_0,...,F_{n-1} (shape (n,d,d)) of expm(V t),
+    where V is the upper block-bidiagonal block-Toeplitz matrix with
+    n diagonal blocks T and superdiagonal blocks C, such that block
+    (i,j) of expm(V t) is F_{j-i}. Products of such matrices are block
+    convolutions of their sequences of blocks, so expm is computed by
+    scaling and squaring on the sequences: a Taylor series for
+    expm(V t/2^s) (each term costs n products with T and C) followed
+    by s squarings, i.e. O(n^2) instead of O(n^3) block products.
+    """
+
+    d = T.shape[0]
+    norm = (np.max(np.sum(np.abs(T), axis=0)) + np.max(np.sum(np.abs(C), axis=0))) * t
+    s = max(0, math.ceil(math.log2(norm / theta))) if norm > 0 else 0
+    Th, Ch = T * (t / 2**s), C * (t / 2**s)
+
+    F = np.zeros((n, d, d))
+    F[0] = np.eye(d)
+    term = F[:1].copy()  # the j-th power of V has j+1 nonzero blocks
+    for j in range(1, order + 1):
+        new = np.zeros((min(j + 1, n), d, d))
+        new[:len(term)] = term @ Th  # (X V)_l = X_l T + X_{l-1} C
+        new[1:] += term[:len(new)-1] @ Ch
+        term = new / j
+        F[:len(term)] += term
+        if j % 4 == 0 and np.max(np.abs(term)) < 1e-18:
+            break
+
+    left, right, starts = _convolution_pairs(n)
+    for _ in range(s):
+        F = np.add.reduceat(F[left] @ F[right], starts, axis=0)
+
+    return F
+
+
+def toeplitz_pays_off(d, n):
+    """
+    Returns whether the exponential of a block-Toeplitz window of n
+    blocks of size d is computed faster by toeplitz_expm than by a dense
+    expm. Its O(n^2) small block products (and the convolutions with
+    the result) only beat the O((n d)^3) BLAS work of a dense expm for
+    windows of at least TOEPLITZ_MIN_STATES states.
+    """
+
+    return n * d >= TOEPLITZ_MIN_STATES
+
+
+class BlockToeplitz:
+    """
+    Upper block-triangular block-Toeplitz matrix whose block (i,j) is
+    F[j-i] for j >= i, such as the exponential of a window of a
+    block-Toeplitz BlockBidiagonal. Products with row vectors (G @ E)
+    and column vectors (E @ v) are block convolutions over the F_j, so
+    only the n blocks F_j are stored, not the dense matrix.
+    """
+
+    __array_ufunc__ = None  # g @ E with an array g calls __rmatmul__
+
+    def __init__(self, F):
+
+        self.F = F
+        n, d, _ = F.shape
+        self.shape = (n * d, n * d)
+
+    def _shifted(self, v, sign):
+
+        # rows (i, l) hold the block i - l (sign = -1) or i + l (sign = 1) of v, or zeros
+        n, d, _ = self.F.shape
+        padded = np.concatenate((np.zeros((1, d)), np.reshape(v, (n, d))))
+        idx = np.arange(n)[:,None] + sign * np.arange(n)[None,:]
+        idx = np.where((idx >= 0) & (idx < n), idx + 1, 0)
+        return padded[idx].reshape(n, n * d)
+
+    def __rmatmul__(self, g):
+
+        # (g E)_j = sum_l g_{j-l} F_l
+        n, d, _ = self.F.shape
+        return (self._shifted(g, -1) @ self.F.reshape(n * d, d)).ravel()
+
+    def __matmul__(self, v):
+
+        # (E v)_i = sum_l F_l v_{i+l}
+        n, d, _ = self.F.shape
+        return (self._shifted(v, 1) @ self.F.transpose(0, 2, 1).reshape(n * d, d)).ravel()
+
+    def todense(self):
+
+        n, d, _ = self.F.shape
+        idx = np.arange(n)[None,:] - np.arange(n)[:,None]
+        M = np.where((idx >= 0)[:,:,None,None], self.F[np.maximum(idx, 0)], 0)
+        return M.transpose(0, 2, 1, 3).reshape(self.shape)
+
+
+class BlockBidiagonal:
+    """
+    Upper block-bidiagonal matrix with square diagonal blocks blocks[i]
+    and rank-one superdiagonal blocks left[i] (column) times right[i]
+    (row), as Vn and Sn are. Only the blocks and the rank-one factors
+    are stored; solves are done by block substitution on the leading
+    blocks, so the full matrix and its inverse are never formed.
+    """
+
+    def __init__(self, blocks, left, right):
+
+        self.blocks = [np.asarray(B, dtype=float) for B in blocks]
+        self.left = [np.ravel(l).astype(float) for l in left]
+        self.right = [np.ravel(r).astype(float) for r in right]
+        self.sizes = [B.shape[0] for B in self.blocks]
+        self.offsets = np.cumsum([0] + self.sizes)
+        self.shape = (self.offsets[-1], self.offsets[-1])
+        self._blocks_inv = None
+        self._neg_inv_ones = None
+        self._sparse = None
+        self._expm = OrderedDict()  # block sequences of expm(M t) by t
+        self._lock = threading.Lock()  # guards _expm, which threads may share
+
+        # equal blocks (homogeneous clients) make the matrix block-Toeplitz
+        self.toeplitz = all(np.array_equal(B, self.blocks[0]) for B in self.blocks) and \
+            all(np.array_equal(l, self.left[0]) for l in self.left) and \
+            all(np.array_equal(r, self.right[0]) for r in self.right)
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __getstate__(self):
+
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def nbytes(self):
+        """
+        Returns the memory held by the blocks and by the inverses, the
+        sparse form and the exponentials cached so far.
+        """
+
+        arrays = self.blocks + self.left + self.right + (self._blocks_inv or [])
+        if self._neg_inv_ones is not None:
+            arrays.append(self._neg_inv_ones)
+        if self._sparse is not None:
+            arrays += [self._sparse.data, self._sparse.indices, self._sparse.indptr]
+        with self._lock:
+            arrays += list(self._expm.values())
+
+        return sum(a.nbytes for a in arrays)
+
+    def clear_expm(self):
+        """
+        Empties the cache of exponentials (e.g. to time the kernels).
+        """
+
+        with self._lock:
+            self._expm.clear()
+
+    def blocks_inv(self):
+        """
+        Returns the inverses of the (small) diagonal blocks.
+        """
+
+        if self._blocks_inv is None:
+            self._blocks_inv = [np.linalg.inv(B) for B in self.blocks]
+
+        return self._blocks_inv
+
+    def todense(self, n=None):
+        """
+        Returns the leading n blocks as a dense array.
+        """
+
+        n = len(self) if n is None else n
+        D = self.offsets
+        M = np.zeros((D[n], D[n]))
+
+        for i in range(n):
+            M[D[i]:D[i+1], D[i]:D[i+1]] = self.blocks[i]
+            if i < n - 1:
+                M[D[i]:D[i+1], D[i+1]:D[i+2]] = np.outer(self.left[i], self.right[i])
+
+        return M
+
+    def tosparse(self, n=None):
+        """
+        Returns the leading n blocks as a CSR matrix.
+        """
+
+        if self._sparse is None:
+
+            from scipy.sparse import coo_matrix
+
+            D = self.offsets
+            rows, cols, vals = [], [], []
+
+            for i in range(len(self)):
+                blocks = [(self.blocks[i], D[i])]
+                if i < len(self) - 1:
+                    blocks.append((np.outer(self.left[i], self.right[i]), D[i+1]))
+                for B, col in blocks:
+                    r, c = np.nonzero(B)
+                    rows.append(r + D[i])
+                    cols.append(c + col)
+                    vals.append(B[r,c])
+
+            self._sparse = coo_matrix((np.concatenate(vals), (np.concatenate(rows), np.concatenate(cols))),
+                                      shape=self.shape).tocsr()
+
+        if n is None or n == len(self):
+            return self._sparse
+
+        return self._sparse[:self.offsets[n],:self.offsets[n]]
+
+    def expm(self, t, n=None, cache_size=EXPM_CACHE_SIZE):
+        """
+        Returns expm(M_n t), where M_n consists of the leading n blocks.
+        If the matrix is block-Toeplitz, so is M_n, as is any window of
+        n consecutive blocks, and the blocks of the exponential are
+        computed by toeplitz_expm and returned as a BlockToeplitz, which
+        is never densified. Otherwise, a dense array is returned.
+        Sequences are cached by t, such that steps with equal t (e.g.
+        zero or fixed interarrival times) reuse them.
+        """
+
+        n = len(self) if n is None else n
+
+        if not self.toeplitz:
+            return expm(self.todense(n) * t)
+
+        t = float(t)
+        with self._lock:
+            F = self._expm.get(t)
+        if F is None or len(F) < n:
+            # extend a cached sequence to the full length at once
+            length = n if F is None or not len(self.left) else len(self)
+            C = np.outer(self.left[0], self.right[0]) if len(self.left) else np.zeros_like(self.blocks[0])
+            F = toeplitz_expm(self.blocks[0], C, t, length)
+            with self._lock:
+                self._expm[t] = F
+                while len(self._expm) > cache_size:
+                    self._expm.popitem(last=False)
+        else:
+            with self._lock:
+                if t in self._expm:
+                    self._expm.move_to_end(t)
+
+        return BlockToeplitz(F[:n])
+
+    def solve_left(self, v, n=None):
+        """
+        Returns v @ inv(M_n) for a row vector v (or a matrix of row
+        vectors), where M_n consists of the leading n blocks, by block
+        forward substitution.
+        """
+
+        n = len(self) if n is None else n
+        D = self.offsets
+        B_inv = self.blocks_inv()
+        v = np.atleast_2d(np.asarray(v, dtype=float))
+        w = np.zeros((v.shape[0], D[n]))
+
+        for i in range(n):
+            rhs = v[:, D[i]:D[i+1]]
+            if i:
+                rhs = rhs - np.outer(w[:, D[i-1]:D[i]] @ self.left[i-1], self.right[i-1])
+            w[:, D[i]:D[i+1]] = rhs @ B_inv[i]
+
+        return w
+
+    def neg_inv_ones(self):
+        """
+        Returns, for every n, the vector -inv(M_n) @ 1 by block back
+        substitution (as PrefixVectors, which stores them in O(D + n^2)
+        instead of O(n D) memory). For Vn, the product of the state
+        distribution G_i with the i-th vector is the expected sojourn
+        time of client i.
+        """
+
+        if self._neg_inv_ones is not None:
+            return self._neg_inv_ones
+
+        # block j of vector n is h[j] - s[n,j] * g[j], with s[n,n] = 0 and
+        # s[n,j] = right[j] @ (block j+1) = right[j] @ h[j+1] - s[n,j+1] * right[j] @ g[j+1]
+        n = len(self)
+        B_inv = self.blocks_inv()
+        h = [-np.sum(B, axis=1) for B in B_inv]  # -inv(B) @ 1
+        g = [B_inv[i] @ self.left[i] for i in range(n - 1)] + [np.zeros(self.sizes[-1])]
+        rh = [self.right[j] @ h[j+1] for j in range(n - 1)]
+        rg = [self.right[j] @ g[j+1] for j in range(n - 1)]
+
+        s = np.zeros((n, n))
+        for j in range(n - 2, -1, -1):
+            s[j+1:,j] = rh[j] - s[j+1:,j+1] * rg[j]
+
+        self._neg_inv_ones = PrefixVectors(np.concatenate(h), np.concatenate(g), s, self.sizes)
+        return self._neg_inv_ones
+
+
+class PrefixVectors:
+    """
+    The vectors -inv(M_n) @ 1 of BlockBidiagonal.neg_inv_ones for all
+    n. Block j of vector n is h[j] - s[n,j] * g[j], so only the blocks
+    h and g and the scalars s are stored, and vector n is formed when
+    it is indexed (in O(D_n), as is its product with a distribution).
+    """
+
+    def __init__(self, h, g, s, sizes):
+
+        self.h, self.g, self.s = h, g, s
+        self.sizes = np.asarray(sizes)
+        self.offsets = np.cumsum([0] + list(sizes))
+
+    def __len__(self):
+        return len(self.sizes)
+
+    def __getitem__(self, n):
+
+        if not -len(self) <= n < len(self):
+            raise IndexError(n)
+        n %= len(self)
+        D = self.offsets[n+1]
+
+        return self.h[:D] - np.repeat(self.s[n,:n+1], self.sizes[:n+1]) * self.g[:D]
+
+    @property
+    def nbytes(self):
+        return self.h.nbytes + self.g.nbytes + self.s.nbytes
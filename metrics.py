@@ -0,0 +1,249 @@
+import os, json, time, logging, sqlite3, cProfile, tempfile, threading
+import numpy as np
+
+from collections import defaultdict
+from contextlib import closing
+
+
+# configuration (shared by all gunicorn workers through the environment)
+METRICS_ENABLED = os.environ.get('SCHEDULE_METRICS', '1') != '0'
+METRICS_PATH = os.environ.get('SCHEDULE_METRICS_PATH', os.path.join(tempfile.gettempdir(), 'adaptive_schedule_cache.sqlite'))
+PROFILE_DIR = os.environ.get('SCHEDULE_PROFILE_DIR')  # if set, a profile of every request is written here
+REQUEST_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120]  # seconds
+
+logger = logging.getLogger(__name__)
+_local = threading.local()  # the request recorded by the current thread
+
+
+class RequestMetrics:
+    """
+    Timings (calls and seconds per stage) and counters
+    aggregated over a single request, which the threads of
+    a thread pool may share (see bind).
+    """
+
+    def __init__(self, kind):
+
+        self.kind = kind
+        self.stages = defaultdict(lambda: [0, 0.0])
+        self.counters = defaultdict(float)
+        self.lock = threading.Lock()
+        self.start = time.perf_counter()
+        self.duration = None
+
+    def summary(self):
+
+        return {'kind': self.kind, 'duration': self.duration,
+                'stages': {name: {'calls': calls, 'seconds': seconds} for name, (calls, seconds) in self.stages.items()},
+                'counters': dict(self.counters)}
+
+
+class stage:
+    """
+    Context manager that adds the wall time of its body to the
+    given stage of the request recorded by the current thread.
+    Outside a recorded request, it does nothing.
+    """
+
+    __slots__ = ('name', 'record', 'start')
+
+    def __init__(self, name):
+
+        self.name = name
+        self.record = getattr(_local, 'record', None)
+
+    def __enter__(self):
+
+        if self.record is not None:
+            self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+
+        if self.record is not None:
+            add_time(self.name, time.perf_counter() - self.start, self.record)
+
+
+def add_time(name, seconds, record=None, calls=1):
+    """
+    Adds seconds to a stage of the current request, if any.
+    """
+
+    record = record or getattr(_local, 'record', None)
+    if record is not None:
+        with record.lock:
+            entry = record.stages[name]
+            entry[0] += calls
+            entry[1] += seconds
+
+
+def count(name, value=1):
+    """
+    Increments a counter of the current request, if any.
+    """
+
+    record = getattr(_local, 'record', None)
+    if record is not None:
+        with record.lock:
+            record.counters[name] += value
+
+
+def bind(fn):
+    """
+    Returns fn such that its stages and counters are added to the
+    request recorded by the current thread, also when it is called by
+    the worker threads of a thread pool. The request is not passed to
+    process workers (fn must then be picklable), which are not recorded.
+    """
+
+    record = getattr(_local, 'record', None)
+    if record is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        previous = getattr(_local, 'record', None)
+        _local.record = record
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _local.record = previous
+
+    return bound
+
+
+class request:
+    """
+    Context manager that records the stages and counters of the
+    computations in its body (in the current thread), adds them to
+    the shared metrics on exit, and writes a profile (cProfile stats
+    and a JSON summary) to PROFILE_DIR if it is set. Nested requests
+    are part of the outer one.
+    """
+
+    def __init__(self, kind='schedule', store=None, profile_dir=PROFILE_DIR):
+
+        self.kind = kind
+        self.store = store
+        self.profile_dir = profile_dir
+        self.record = None
+        self.profile = None
+
+    def __enter__(self):
+
+        if not METRICS_ENABLED or getattr(_local, 'record', None) is not None:
+            return None
+
+        self.record = _local.record = RequestMetrics(self.kind)
+        if self.profile_dir:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+
+        return self.record
+
+    def __exit__(self, exc_type, *exc):
+
+        if self.record is None:
+            return
+
+        if self.profile is not None:
+            self.profile.disable()
+        _local.record = None
+        self.record.duration = time.perf_counter() - self.record.start
+        status = 'failed' if exc_type else 'done'
+
+        try:
+            (self.store or default_store()).add(self.record, status)
+            if self.profile is not None:
+                self._write_profile(status)
+        except Exception:  # metrics must never fail a request
+            logger.exception('failed to store the metrics of a request')
+
+    def _write_profile(self, status):
+
+        os.makedirs(self.profile_dir, exist_ok=True)
+        name = os.path.join(self.profile_dir, f'{self.kind}-{time.strftime("%Y%m%d-%H%M%S")}-{os.getpid()}-'
+                                              f'{threading.get_ident()}')
+        self.profile.dump_stats(name + '.prof')
+        with open(name + '.json', 'w') as f:
+            json.dump({**self.record.summary(), 'status': status}, f, indent=1)
+        logger.info('profile written to %s.prof (%.3fs)', name, self.record.duration)
+
+
+class MetricsStore:
+    """
+    Cumulative metrics of all requests, kept in an SQLite table
+    such that every worker process can report them, rendered in
+    the Prometheus text exposition format.
+    """
+
+    def __init__(self, path=METRICS_PATH):
+
+        self.path = path
+
+        with closing(self._connect()) as con, con:
+            con.execute('CREATE TABLE IF NOT EXISTS metrics (name TEXT, labels TEXT, value REAL, '
+                        'PRIMARY KEY (name, labels))')
+
+    def _connect(self):
+
+        return sqlite3.connect(self.path, timeout=30)
+
+    def add(self, record, status='done'):
+        """
+        Adds the stages and counters of a finished request.
+        """
+
+        kind = f'kind="{record.kind}"'
+        rows = [('schedule_requests_total', f'{kind},status="{status}"', 1),
+                ('schedule_request_duration_seconds_sum', kind, record.duration),
+                ('schedule_request_duration_seconds_count', kind, 1)]
+        rows += [('schedule_request_duration_seconds_bucket', f'{kind},le="{le}"', float(record.duration <= le))
+                 for le in REQUEST_BUCKETS + [np.inf]]
+
+        for name, (calls, seconds) in record.stages.items():
+            rows += [('schedule_stage_seconds_total', f'stage="{name}"', seconds),
+                     ('schedule_stage_calls_total', f'stage="{name}"', calls)]
+        rows += [(f'schedule_{name}_total', '', value) for name, value in record.counters.items()]
+
+        with closing(self._connect()) as con, con:
+            con.executemany('INSERT INTO metrics VALUES (?, ?, ?) ON CONFLICT (name, labels) '
+                            'DO UPDATE SET value = value + excluded.value', rows)
+
+    def render(self):
+        """
+        Returns all metrics in the Prometheus text format.
+        """
+
+        with closing(self._connect()) as con:
+            rows = con.execute('SELECT name, labels, value FROM metrics').fetchall()
+
+        # histogram buckets in increasing order of their upper bounds
+        le = lambda labels: float(labels.split('le="')[1][:-1]) if 'le="' in labels else 0
+        rows.sort(key=lambda row: (row[0], row[1].split(',le=')[0], le(row[1])))
+
+        lines, families = [], set()
+        for name, labels, value in rows:
+            family = name.rsplit('_', 1)[0] if name.startswith('schedule_request_duration_seconds') else name
+            if family not in families:
+                families.add(family)
+                kind = 'histogram' if family != name else 'counter'
+                lines.append(f'# TYPE {family} {kind}')
+            value = repr(float(value)).replace('inf', '+Inf')
+            labels = labels.replace('le="inf"', 'le="+Inf"')
+            lines.append(f'{name}{{{labels}}} {value}' if labels else f'{name} {value}')
+
+        return '\n'.join(lines) + '\n'
+
+
+_default_store = None
+
+def default_store():
+    """
+    Returns the metrics store configured through the environment.
+    """
+
+    global _default_store
+    if _default_store is None:
+        _default_store = MetricsStore()
+
+    return _default_store
+
@@ -1,10 +1,25 @@
-import math, time
+import os, math, time, threading
 import numpy as np
 
-from scipy.stats import poisson
-from scipy.optimize import minimize, LinearConstraint  # optimization
-from scipy.linalg import inv  # matrix inversion
-from scipy.sparse.linalg import expm  # matrix exponential
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from solvers import solve  # optimization
+from scipy.linalg import expm  # matrix exponential
+
+from kernels import expm_action, expm_action_rows, poisson_pmf, toeplitz_pays_off, BlockBidiagonal
+import metrics  # instrumentation
+from parallel import pool_blas_threads
+
+
+# coarse stages (expm_tol, eps, optimizer tol) of the adaptive precision mode
+PRECISION_STAGES = [(1e-3, 1e-3, 1e-2), (1e-7, 1e-7, 1e-5)]
+
+# model caches (see phase_fit and ModelCache)
+PHASE_FIT_CACHE_SIZE = int(os.environ.get('SCHEDULE_PHASE_FIT_CACHE_SIZE', 4096))
+MODEL_CACHE_BYTES = int(os.environ.get('SCHEDULE_MODEL_CACHE_BYTES', 256 * 2**20))
+
+# relative tolerance of the lumping of phases (see reduce_phases)
+PHASE_REDUCTION_TOL = float(os.environ.get('SCHEDULE_PHASE_REDUCTION_TOL', 1e-10))
 
 
 def phase_parameters(mean, SCV, u):
@@ -23,16 +38,15 @@ def phase_parameters(mean, SCV, u):
         mu = (K + 1 - p) / mean
         
         # initial distribution
-        gamma_i = np.zeros((1,K+1))
-        B_sf = poisson.cdf(K-1,mu*u) + (1 - p) * poisson.pmf(K,mu*u)
-        for z in range(K+1):
-            gamma_i[0,z] = poisson.pmf(z,mu*u) / B_sf
+        P = poisson_pmf(K,mu*u)
+        B_sf = np.sum(P[:K]) + (1 - p) * P[K]
+        gamma_i = (P / B_sf).reshape(1,K+1)
         gamma_i[0,K] *= (1 - p) 
         
         # transition rate matrix
+        z = np.arange(K-1)
         Ti = -mu * np.eye(K+1)
-        for i in range(K-1):
-            Ti[i,i+1] = mu
+        Ti[z,z+1] = mu
         Ti[K-1,K] = (1-p) * mu
             
     # hyperexponential case
@@ -57,14 +71,97 @@ def phase_parameters(mean, SCV, u):
     return gamma_i, Ti
 
 
-def create_Vn(gamma, T):
+_phase_fits = OrderedDict()  # (mean, SCV, u) -> phase_parameters(mean, SCV, u)
+_phase_fits_lock = threading.Lock()
+
+def phase_fit(mean, SCV, u=0):
+    """
+    Returns phase_parameters(mean, SCV, u) as read-only arrays. The fits
+    are kept per client in an LRU cache of PHASE_FIT_CACHE_SIZE entries,
+    such that sessions with clients in common share them.
+    """
+
+    key = (float(mean), float(SCV), float(u))
+    with _phase_fits_lock:
+        fit = _phase_fits.get(key)
+        if fit is not None:
+            _phase_fits.move_to_end(key)
+            return fit
+
+    fit = phase_parameters(*key)
+    for a in fit:
+        a.setflags(write=False)
+
+    with _phase_fits_lock:
+        _phase_fits[key] = fit
+        while len(_phase_fits) > PHASE_FIT_CACHE_SIZE:
+            _phase_fits.popitem(last=False)
+
+    return fit
+
+
+def reduce_phases(gamma_i, Ti, tol=PHASE_REDUCTION_TOL):
+    """
+    Removes the redundant phases of a fit of phase_parameters: the two
+    phases of a hyperexponential fit with (nearly) equal rates, as for
+    SCV = 1, are lumped into one exponential phase with the same mean,
+    and the last phase of a weighted Erlang fit that is (nearly) never
+    reached, as for SCV = 1/K, is dropped. Returns the reduced fit and
+    a bound on E|B - B'|, the change of the service time B (coupled
+    phase by phase), which is 0 if the reduction is exact.
+    """
+
+    d = Ti.shape[0]
+    gamma = np.ravel(gamma_i)
+    rates = -np.diag(Ti)
+
+    # hyperexponential with mu1 ~ mu2
+    if d == 1:
+        return gamma_i, Ti, 0
+    if not np.any(Ti - np.diag(-rates)):
+        if abs(rates[0] - rates[1]) > tol * rates.max():
+            return gamma_i, Ti, 0
+        mean = gamma @ (1 / rates)
+        error = gamma @ np.abs(1 / rates - mean)
+        return np.ones((1,1)), np.array([[-1 / mean]]), float(error)
+
+    # weighted Erlang of which the last phase is reached with probability ~ 0
+    mu = rates[0]
+    reach = abs(Ti[d-2,d-1]) / mu  # probability of reaching the last phase from the one before
+    if reach > tol or gamma[d-1] > tol:
+        return gamma_i, Ti, 0
+    gamma_r = gamma[:d-1].copy()
+    gamma_r[d-2] += gamma[d-1]
+
+    return gamma_r.reshape(1,d-1), Ti[:d-1,:d-1].copy(), float((reach + gamma[d-1]) / mu)
+
+
+def warm_phase_fits(SCVs, means=(1,)):
+    """
+    Computes the phase fits of all combinations of means and SCVs in
+    advance, e.g. before the worker processes of the app are forked.
+    """
+
+    for mean in means:
+        for SCV in SCVs:
+            phase_fit(mean, SCV)
+
+
+def create_Vn(gamma, T, structured=False):
     """
     Creates the matrix Vn given the initial
     distributions and transition matrices.
+    If structured, Vn is returned in BlockBidiagonal
+    form, i.e. only its diagonal blocks T[i] and the
+    rank-one factors of its superdiagonal blocks.
     """
     
-    # initialize Vn
     n = len(T)
+    if structured:
+        exits = [-np.sum(T[i], axis=1) for i in range(n - 1)]
+        return BlockBidiagonal(T, exits, gamma[1:])
+
+    # initialize Vn
     d = [T[i].shape[0] for i in range(n)]
     D = np.cumsum([0] + d)
     Vn = np.zeros((D[n], D[n]))
@@ -79,46 +176,629 @@ def create_Vn(gamma, T):
     return Vn
 
 
-def cost(x, EB, gamma, Vn, Vn_inv, omega, k, fixed_inter_times):
+def build_model(EB, SCV, u=0, method='expm', tol=PHASE_REDUCTION_TOL):
+    """
+    Returns the model of a session that only depends on the means, SCVs
+    and the elapsed service time u of the client in service: the initial
+    distributions gamma, Vn (dense, which takes O(D^2) memory, or sparse
+    if method='action') and Vn in BlockBidiagonal form with its
+    factorization (which replaces inv(Vn), but not the dense Vn that the
+    expm method windows), after the redundant phases of the fits are
+    removed with tolerance tol (see reduce_phases). The last entry is a
+    bound on the resulting change of the cost: the idle and waiting
+    times of client j change by at most sum_{i<j} E|B_i - B_i'|.
+    """
+
+    N = len(EB)
+    u_full = [u] + [0] * (N - 1)
+    with metrics.stage('phase_parameters'):
+        fits = [reduce_phases(*phase_fit(EB[i], SCV[i], u_full[i]), tol) for i in range(N)]
+        gamma, T, errors = zip(*fits)
+        reduction_error = sum((N - 1 - i) * errors[i] for i in range(N))
+    with metrics.stage('create_Vn'):
+        Vn_blocks = create_Vn(gamma, T, structured=True)
+        Vn = Vn_blocks.tosparse() if method == 'action' else Vn_blocks.todense()
+    with metrics.stage('inv'):
+        Vn_blocks.neg_inv_ones()  # replaces inv(Vn)
+
+    if method != 'action':
+        Vn.setflags(write=False)  # shared by the problems of the model cache
+
+    return gamma, Vn, Vn_blocks, reduction_error
+
+
+class ModelCache:
+    """
+    LRU cache of the models of build_model keyed by (EB, SCV, u), such
+    that requests that only change omega, tau, k or the fixed arrival
+    times reuse the phase fits, Vn and its factorization. The models
+    are evicted (least recently used first) when their total size,
+    including the exponentials that the models cache as they are used
+    (at most EXPM_CACHE_SIZE sequences each), exceeds max_bytes. As
+    these grow after a model is inserted, the size is checked whenever
+    a model is requested. max_bytes = 0 disables the cache.
+    """
+
+    def __init__(self, max_bytes=MODEL_CACHE_BYTES):
+
+        self.max_bytes = max_bytes
+        self.models = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, EB, SCV, u=0, method='expm', tol=PHASE_REDUCTION_TOL):
+        """
+        Returns build_model(EB, SCV, u, method, tol), cached if possible.
+        """
+
+        key = (tuple(float(i) for i in EB), tuple(float(i) for i in SCV), float(u), method == 'action', float(tol))
+        with self._lock:
+            model = self.models.get(key)
+            if model is not None:
+                self.models.move_to_end(key)
+                self._evict()
+        if model is not None:
+            metrics.count('model_cache_hits')
+            return model
+        metrics.count('model_cache_misses')
+
+        model = build_model(EB, SCV, u, method, tol)
+        if self.max_bytes > 0:
+            with self._lock:
+                self.models[key] = model
+                self._evict()
+
+        return model
+
+    def nbytes(self):
+
+        with self._lock:
+            return sum(self._size(model) for model in self.models.values())
+
+    @staticmethod
+    def _size(model):
+
+        _, Vn, Vn_blocks, _ = model
+        Vn_bytes = Vn.nbytes if isinstance(Vn, np.ndarray) else Vn.data.nbytes + Vn.indices.nbytes + Vn.indptr.nbytes
+
+        return Vn_bytes + Vn_blocks.nbytes() + sum(gamma_i.nbytes for gamma_i in model[0])
+
+    def _evict(self):
+
+        sizes = [self._size(model) for model in self.models.values()]
+        total = sum(sizes)
+        for size in sizes[:-1]:  # keeps the newest model
+            if total <= self.max_bytes:
+                break
+            self.models.popitem(last=False)
+            total -= size
+
+    def clear(self):
+
+        with self._lock:
+            self.models.clear()
+
+
+_default_model_cache = None
+
+def default_model_cache():
+    """
+    Returns the model cache configured through SCHEDULE_MODEL_CACHE_BYTES.
+    """
+
+    global _default_model_cache
+    if _default_model_cache is None:
+        _default_model_cache = ModelCache()
+
+    return _default_model_cache
+
+
+def propagate(G, A, t, method='expm', tol=1e-12):
+    """
+    Returns G @ expm(A * t), either by forming the matrix
+    exponential (method='expm') or by computing its action
+    on G directly up to tolerance tol (method='action').
+    """
+
+    metrics.count('expm_calls')
+    metrics.count('expm_states', A.shape[0])
+
+    with metrics.stage('expm'):
+        if method == 'expm':
+            return G @ expm(A * t)
+        elif method == 'action':
+            return expm_action(G, A, t, tol)
+        else:
+            raise ValueError(f'Unknown method {method!r}.')
+
+
+def window_expm(Vn, Vn_inv, O, a, b, t):
+    """
+    Returns expm(Vn[O[a]:O[b],O[a]:O[b]] * t), the matrix exponential
+    of the window of clients a,...,b-1. If Vn_inv is Vn in BlockBidiagonal
+    form and all clients are equal (homogeneous), Vn is block-Toeplitz
+    and, for large windows (see toeplitz_pays_off), the blocks of the
+    exponential follow from those of the single-client T and the
+    coupling (see BlockBidiagonal.expm), as a BlockToeplitz.
+    """
+
+    metrics.count('expm_calls')
+    metrics.count('expm_states', O[b] - O[a])
+
+    with metrics.stage('expm'):
+        if isinstance(Vn_inv, BlockBidiagonal) and Vn_inv.toeplitz and toeplitz_pays_off(O[1] - O[0], b - a):
+            return Vn_inv.expm(t, b - a)
+        return expm(Vn[O[a]:O[b],O[a]:O[b]] * t)
+
+
+def sojourn_vectors(Vn_inv, D):
+    """
+    Returns the vectors -Vn_inv[:D[i],:D[i]] @ 1, such that G[i]
+    times the i-th vector is the expected sojourn time of client i.
+    Vn_inv is either the dense inverse of Vn, or Vn in BlockBidiagonal
+    form, in which case no inverse is formed.
+    """
+
+    if isinstance(Vn_inv, BlockBidiagonal):
+        return Vn_inv.neg_inv_ones()
+
+    return [-np.sum(Vn_inv[:D[i],:D[i]], axis=1) for i in range(len(D))]
+
+
+class ScheduleProblem:
+    """
+    The cost function of one scheduling problem, set up once: the block
+    offsets, the sojourn vectors, the windows of Vn, the interarrival
+    times of the clients in the system and those with fixed times, and
+    buffers for the state distributions and expectations, such that
+    an evaluation only allocates the outputs of the expm kernels.
+    Vn_inv may also be Vn in BlockBidiagonal form.
+    If eps > 0, the state space is truncated before every
+    step (see _forward), such that only a bounded window of
+    Vn is propagated. The total folded probability mass and
+    the largest window of the last evaluation are kept in
+    truncation_error and max_window. If the model was reduced
+    (see build_model), reduction_error bounds the change of the cost.
+    """
+
+    def __init__(self, EB, gamma, Vn, Vn_inv, omega, k, fixed_inter_times, method='expm', tol=1e-12, eps=0):
+
+        if method not in ('expm', 'action'):
+            raise ValueError(f'Unknown method {method!r}.')
+
+        self.EB = np.asarray(EB, dtype=float)
+        self.gamma = [np.ravel(gamma_i) for gamma_i in gamma]
+        self.Vn, self.Vn_inv = Vn, Vn_inv
+        self.omega, self.k, self.m = omega, k, len(fixed_inter_times)
+        self.method, self.tol, self.eps = method, tol, eps
+
+        self.n = n = len(gamma)  # total number of clients
+        self.O = O = np.cumsum([0] + [len(gamma_i) for gamma_i in self.gamma])  # block offsets
+        self.Z = sojourn_vectors(Vn_inv, O[1:])
+        self._windows = {}  # windows of Vn by (first, last + 1) client
+
+        # all interarrival times, including the clients who are already in system
+        self.x = np.zeros(n)
+        self.x[k:k+self.m] = fixed_inter_times
+
+        # cost = omega * sum(x) + sum(c[i] * ES[i]) + constant
+        self.c = np.zeros(n)
+        self.c[1:] += 1
+        self.c[:-1] -= omega
+
+        # buffers
+        self.G = np.zeros(O[n])  # state distribution, the window O[W[i]]:O[i+1] after step i
+        self.P = [None] * (n - 1)  # propagated distributions
+        self.E = [None] * (n - 1)  # matrix exponentials (method='expm')
+        self.W = np.zeros(n, dtype=int)  # first client of the window of G before every step
+        self.S = np.zeros(n, dtype=int)  # first client of the window after truncation
+        self.ES = np.zeros(n)
+        self.EW = np.zeros(n)
+        self.EI = np.zeros(n)
+        self.grad = np.zeros(n)
+        self.truncation_error, self.max_window = 0, O[1]
+        self.reduction_error = 0  # bound on the change of the cost by reduce_phases
+        self._cost_x, self._grad_x = None, None  # memoized evaluations
+
+    @classmethod
+    def create(cls, EB, SCV, omega, fixed_inter_times, k=1, u=0, method='expm', tol=1e-12, eps=0, models=None):
+        """
+        Sets up the problem from the means and SCVs of all clients,
+        taking the model from the model cache models (by default
+        default_model_cache()).
+        """
+
+        models = default_model_cache() if models is None else models
+        gamma, Vn, Vn_blocks, reduction_error = models.get(EB, SCV, u, method)
+        metrics.count('states', Vn.shape[0])
+
+        problem = cls(EB, gamma, Vn, Vn_blocks, omega, k, fixed_inter_times, method, tol, eps)
+        problem.reduction_error = reduction_error
+
+        return problem
+
+    def with_precision(self, tol, eps):
+        """
+        Returns the same problem evaluated with expm tolerance tol
+        (method='action') and truncation threshold eps.
+        """
+
+        problem = ScheduleProblem(self.EB, self.gamma, self.Vn, self.Vn_inv, self.omega, self.k,
+                                  self.x[self.k:self.k+self.m], self.method, tol, eps)
+        problem._windows, problem.reduction_error = self._windows, self.reduction_error
+
+        return problem
+
+    def with_omega(self, omega):
+        """
+        Returns the same problem with weight omega, which shares gamma,
+        Vn and its windows (and cached exponentials), as these do not
+        depend on omega.
+        """
+
+        problem = ScheduleProblem(self.EB, self.gamma, self.Vn, self.Vn_inv, omega, self.k,
+                                  self.x[self.k:self.k+self.m], self.method, self.tol, self.eps)
+        problem._windows, problem.reduction_error = self._windows, self.reduction_error
+
+        return problem
+
+    def window(self, a, b):
+        """
+        Returns the window of Vn of the clients a,...,b-1.
+        """
+
+        A = self._windows.get((a,b))
+        if A is None:
+            O = self.O
+            A = self._windows[a,b] = self.Vn[O[a]:O[b],O[a]:O[b]]
+
+        return A
+
+    def _forward(self, x, store):
+
+        metrics.count('cost_evaluations')
+        n, O, G, gamma, eps = self.n, self.O, self.G, self.gamma, self.eps
+        self.x[self.k+self.m:] = x
+        x = self.x
+
+        G[:O[1]] = gamma[0]
+        a = 0  # first client of the window of G
+        self.ES[0] = gamma[0] @ self.Z[0]
+        folded, window = 0, O[1]
+
+        for i in range(1, n):
+
+            self.W[i-1] = a
+            # the leading clients a,...,s-1 (s < i maximal) whose total probability of still being in service
+            # is below eps are considered done, i.e. their mass is folded into the initial distribution of s
+            if eps:
+                cum = np.cumsum(np.add.reduceat(G[O[a]:O[i]], O[a:i] - O[a]))
+                s = a + min(np.searchsorted(cum, eps), i - 1 - a)
+                if s > a:
+                    G[O[s]:O[s+1]] += cum[s-a-1] * gamma[s]
+                    folded += cum[s-a-1]
+                    a = s
+            self.S[i-1] = a
+
+            window = max(window, O[i] - O[a])
+            if self.method == 'expm':
+                E = window_expm(self.Vn, self.Vn_inv, O, a, i, x[i])
+                P = G[O[a]:O[i]] @ E
+                if store:
+                    self.E[i-1] = E
+            else:
+                P = propagate(G[O[a]:O[i]], self.window(a, i), x[i], self.method, self.tol)
+            if store:
+                self.P[i-1] = P
+
+            G[O[a]:O[i]] = P
+            G[O[i]:O[i+1]] = gamma[i] * (1 - np.sum(P))
+            self.ES[i] = G[O[a]:O[i+1]] @ self.Z[i][O[a]:]
+
+        self.W[n-1] = a
+        self.truncation_error, self.max_window = folded, window
+
+        # EW[i] = ES[i] - EB[i], EI[i] = x[i] + EW[i] - ES[i-1]
+        np.subtract(self.ES[1:], self.EB[1:], out=self.EW[1:])
+        np.add(x[1:], self.EW[1:], out=self.EI[1:])
+        self.EI[1:] -= self.ES[:-1]
+        self._cost = self.omega * np.sum(self.EI) + (1 - self.omega) * np.sum(self.EW)
+        self._cost_x = x[self.k+self.m:].copy()
+
+        return self._cost
+
+    def evaluate(self, x):
+        """
+        Returns the cost of the free interarrival times x.
+        """
+
+        if self._cost_x is not None and np.array_equal(x, self._cost_x):
+            return self._cost
+
+        return self._forward(x, False)
+
+    def cost_and_gradient(self, x):
+        """
+        Returns the cost and its exact gradient with respect to the
+        free interarrival times x, using one forward pass over G/P
+        and one backward (adjoint) pass. Since d/dx expm(A x) = A expm(A x),
+        the derivative of every step only needs the exponentials that were
+        already computed in the forward pass (method='expm'), or one
+        extra action of the transposed generator (method='action').
+        The truncation (eps > 0) is linear in G, and is differentiated
+        as such.
+        """
+
+        if self._grad_x is not None and np.array_equal(x, self._grad_x):
+            return self._grad_cost, self.grad[self.k+self.m:].copy()
+
+        self._forward(x, True)
+        n, O, Z, gamma, c, grad = self.n, self.O, self.Z, self.gamma, self.c, self.grad
+
+        # backward pass
+        grad[:] = 0
+        G_bar = c[n-1] * Z[n-1][O[self.W[n-1]]:]
+        for i in range(n - 1, 0, -1):
+            s, a = self.S[i-1], self.W[i-1]
+            d = O[i] - O[s]
+            A = self.window(s, i)
+            P_bar = G_bar[:d] - G_bar[d:] @ gamma[i]
+            grad[i] = self.omega + self.P[i-1] @ (A @ P_bar)
+            if self.method == 'expm':
+                G_trunc_bar = self.E[i-1] @ P_bar
+            else:
+                G_trunc_bar = propagate(P_bar, A.T, self.x[i], self.method, self.tol)
+            if s > a:  # adjoint of the truncation
+                folded_bar = G_trunc_bar[:O[s+1]-O[s]] @ gamma[s]
+                G_trunc_bar = np.concatenate((np.full(O[s] - O[a], folded_bar), G_trunc_bar))
+            G_bar = c[i-1] * Z[i-1][O[a]:] + G_trunc_bar
+
+        self._grad_x, self._grad_cost = self._cost_x, self._cost
+        self.E = [None] * (n - 1)  # release the exponentials
+
+        return self._cost, grad[self.k+self.m:].copy()
+
+    def gradient(self, x):
+        """
+        Returns the gradient of the cost with respect to the free
+        interarrival times x (see cost_and_gradient).
+        """
+
+        return self.cost_and_gradient(x)[1]
+
+    def breakdown(self, x):
+        """
+        Returns the interarrival times of all clients and their expected
+        sojourn, waiting and idle times (before their arrival), and the cost.
+        """
+
+        cost = self.evaluate(x)
+
+        return {'x': self.x.copy(), 'ES': self.ES.copy(), 'EW': self.EW.copy(), 'EI': self.EI.copy(),
+                'cost': cost}
+
+    def breakdown_many(self, X, tol=1e-12):
+        """
+        Returns the breakdown of a stack of candidates X (one row of free
+        interarrival times per candidate) as arrays with one row per
+        candidate. The state distributions of all candidates are stacked,
+        so every step propagates them together by one uniformization
+        over the window of Vn (see expm_action_rows), up to tolerance tol.
+        The state space is not truncated.
+        """
+
+        X = np.atleast_2d(np.asarray(X, dtype=float))
+        C, n, O, gamma, Z = len(X), self.n, self.O, self.gamma, self.Z
+        metrics.count('cost_evaluations', C)
+
+        x = np.tile(self.x, (C,1))
+        x[:,self.k+self.m:] = X
+
+        G = np.zeros((C, O[n]))
+        G[:,:O[1]] = gamma[0]
+        ES = np.zeros((C,n))
+        ES[:,0] = gamma[0] @ Z[0]
+
+        for i in range(1, n):
+            A = self.Vn_inv.tosparse(i) if isinstance(self.Vn_inv, BlockBidiagonal) else self.window(0, i)
+            with metrics.stage('expm'):
+                P = expm_action_rows(G[:,:O[i]], A, x[:,i], tol)
+            G[:,:O[i]] = P
+            G[:,O[i]:O[i+1]] = (1 - np.sum(P, axis=1))[:,None] * gamma[i]
+            ES[:,i] = G[:,:O[i+1]] @ Z[i]
+
+        EW, EI = np.zeros((C,n)), np.zeros((C,n))
+        EW[:,1:] = ES[:,1:] - self.EB[1:]
+        EI[:,1:] = x[:,1:] + EW[:,1:] - ES[:,:-1]
+        cost = self.omega * np.sum(EI, axis=1) + (1 - self.omega) * np.sum(EW, axis=1)
+
+        return {'x': x, 'ES': ES, 'EW': EW, 'EI': EI, 'cost': cost}
+
+    def info(self):
+        """
+        Returns the truncation error and largest window of the last
+        evaluation, and the bound on the error of the phase reduction.
+        """
+
+        return {'truncation_error': self.truncation_error, 'max_window': self.max_window,
+                'reduction_error': self.reduction_error}
+
+
+def cost(x, EB, gamma, Vn, Vn_inv, omega, k, fixed_inter_times, method='expm', tol=1e-12, eps=0, info=None):
+    """
+    Evaluates the cost function given all parameters
+    (see ScheduleProblem, which avoids the setup per call).
+    Vn_inv may also be Vn in BlockBidiagonal form.
+    If eps > 0, the state space is truncated before every
+    step (see ScheduleProblem._forward), such that only a bounded
+    window of Vn is propagated. The total folded probability mass
+    and the largest window are then reported in the dict info.
+    """
+
+    problem = ScheduleProblem(EB, gamma, Vn, Vn_inv, omega, k, fixed_inter_times, method, tol, eps)
+    value = problem.evaluate(x)
+
+    if info is not None:
+        info.update(problem.info())
+
+    return value
+
+
+def cost_and_gradient(x, EB, gamma, Vn, Vn_inv, omega, k, fixed_inter_times, method='expm', tol=1e-12,
+                      eps=0, info=None):
+    """
+    Evaluates the cost function and its exact gradient with respect
+    to the free interarrival times x (see ScheduleProblem.cost_and_gradient).
+    """
+
+    problem = ScheduleProblem(EB, gamma, Vn, Vn_inv, omega, k, fixed_inter_times, method, tol, eps)
+    value, grad = problem.cost_and_gradient(x)
+
+    if info is not None:
+        info.update(problem.info())
+
+    return value, grad
+
+
+def evaluate_schedules(X, EB, SCV, omega, fixed_inter_times=[], k=1, u=0, tol=1e-12):
     """
-    Evaluates the cost function given all parameters.
+    Evaluates many candidate schedules of one session at once, e.g.
+    equidistant or dome-shaped ones and the current booking, against
+    the optimum. X holds one row of free interarrival times per
+    candidate (see free_inter_times), the other arguments are those of
+    optimal_schedule. The model is set up once (see ScheduleProblem).
+    Returns a dict with the interarrival times x of all clients, their
+    expected sojourn, waiting and idle times ES, EW and EI (one row per
+    candidate) and the costs.
     """
 
-    x = np.concatenate((fixed_inter_times, x))
+    problem = ScheduleProblem.create(EB, SCV, omega, fixed_inter_times, k, u)
+
+    return problem.breakdown_many(X, tol)
+
+
+def _optimize(problem, x0, lower_bounds, stages, solver, tol, maxiter, callback=None):
+    """
+    Minimizes the cost of problem from x0, after the coarse stages of
+    the adaptive precision mode, if any. Returns the result of the
+    final run and the information of the stages.
+    """
+
+    # coarse to fine continuation
+    problems = [problem.with_precision(max(t, problem.tol), max(e, problem.eps)) for t, e, _ in stages] + [problem]
+    stage_info = []
+    for (_, _, stage_tol), coarse, refined in zip(stages, problems, problems[1:]):
+        coarse_callback = None if callback is None else lambda x, coarse=coarse: callback(x, coarse.evaluate(x))
+        optim = solve(coarse.cost_and_gradient, x0, lower_bounds, solver, tol=stage_tol, maxiter=maxiter,
+                      callback=coarse_callback)
+        x0 = np.maximum(optim.x, lower_bounds)
+        stage_cost = coarse.evaluate(x0)
+        stage_info.append({'expm_tol': coarse.tol, 'eps': coarse.eps, 'tol': stage_tol, 'nit': optim.nit,
+                           'nfev': optim.nfev, 'wall_time': optim.wall_time, 'cost': stage_cost, **coarse.info(),
+                           'error': abs(refined.evaluate(x0) - stage_cost)})  # a posteriori estimate
+
+    def cost_fun(x):
+        with metrics.stage('cost_and_gradient'):
+            return problem.cost_and_gradient(x)
+
+    # the cost of the iterate is that of the last evaluation
+    iter_callback = None if callback is None else lambda x: callback(x, problem.evaluate(x))
+
+    optim = solve(cost_fun, x0, lower_bounds, solver, tol=tol, maxiter=maxiter, callback=iter_callback)
 
-    n = len(gamma)  # total number of clients
-    x = np.pad(x,(k,0))  # add clients who are already in system
-    D = np.cumsum([gamma_i.shape[1] for gamma_i in gamma])
+    return optim, stage_info
 
-    G = [0] * n
-    P = [0] * (n - 1)
 
-    G[0] = gamma[0]
-    P[0] = G[0] @ expm(Vn[:D[0],:D[0]] * x[1])
+def starting_points(x_init, lower_bounds, count, x0=None):
+    """
+    Returns count starting points for the free interarrival times:
+    the heuristic x_init, the given x0 (e.g. a cached schedule), and
+    dome-shaped (longer in the middle of the session, as optimal
+    schedules are) and scaled variants of the heuristic.
+    """
+
+    L = len(x_init)
+    p = (np.arange(L) + 0.5) / L
+    dome = np.sin(np.pi * p) - 2 / np.pi  # zero mean
+
+    candidates = [x_init] + ([np.asarray(x0, dtype=float)] if x0 is not None and len(x0) == L else [])
+    for a in (0.3, 0.6, 0.15, 0.9):
+        candidates.append(x_init * (1 + a * dome))
+    for scale in (1.2, 0.85, 1.4):
+        candidates.append(x_init * scale)
+
+    unique = []
+    for x in candidates:
+        x = np.maximum(x, lower_bounds)
+        if not any(np.array_equal(x, y) for y in unique):
+            unique.append(x)
+
+    return unique[:count]
+
+
+def initial_guess(EB, fixed_inter_times, tau, k=1):
+    """
+    Returns the heuristic initial guess of the free interarrival
+    times and their lower bounds.
+    """
+
+    N, m = len(EB), len(fixed_inter_times)
+    if m:
+        x_init = np.array([tau] + [EB[i] for i in range(k+1+m,N)])
+        lower_bounds = [tau] + [0] * (N-k-m-1)
+    else:
+        x_init = np.array([EB[0] + k] + [EB[i] for i in range(k+1,N)])
+        lower_bounds = [tau] + [0] * (N-k-1)
 
-    for i in range(1, n):
+    return x_init, lower_bounds
 
-        F = 1 - np.sum(P[i-1])
-        G[i] = np.hstack((P[i-1], gamma[i] * F))
 
-        if i == n - 1:
-            break
+def to_schedule(inter_times, fixed_inter_times, k, u):
+    """
+    Returns the schedule (arrival times) in the format of
+    optimal_schedule given the free interarrival times.
+    """
 
-        P[i] = G[i] @ expm(Vn[:D[i],:D[i]] * x[i+1])
+    inter_times = np.concatenate((fixed_inter_times, inter_times))
 
-    ES = [-np.sum(G[i] @ Vn_inv[:D[i],:D[i]]) for i in range(n)]
-    EW = [0] + [ES[i] - EB[i] for i in range(1,n)]
-    EI = [0] + [x[i] + EW[i] - ES[i-1] for i in range(1,n)]
+    if (k,u) == (1,0):  # system is idle
+        inter_times = np.pad(inter_times, (1,0))
 
-    return omega * np.sum(EI) + (1 - omega) * np.sum(EW)
+    return np.cumsum(inter_times)
 
 
-def optimal_schedule(EB, SCV, omega, fixed_inter_times, tau, k=1, u=0):
+def optimal_schedule(EB, SCV, omega, fixed_inter_times, tau, k=1, u=0, method='expm', expm_tol=1e-12,
+                     x0=None, maxiter=None, callback=None, eps=0, full_output=False, solver='SLSQP',
+                     precision=None, starts=None, executor=None):
     """
     Computes the optimal schedule, given that the
     first clients arrive according to the interarrival 
     times fixed_inter_times, after which the next client
     arrives (at least) after interarrival time tau.
+    With method='action', the distributions are propagated
+    by the action of expm up to tolerance expm_tol, which
+    scales with the number of nonzeros of Vn.
+    The optimizer starts from the interarrival times x0
+    of the clients to be scheduled, if given, and
+    performs at most maxiter iterations, if given.
+    After every iteration, callback(x, cost) is called
+    with the current iterate and its cost, if given.
+    If eps > 0, the state space is truncated (see cost),
+    which bounds the work per client for long sessions.
+    If full_output, a dict with the truncation error, the
+    largest window and optimizer statistics is returned too.
+    The optimizer is selected by solver (see solvers.solve).
+    If precision='adaptive' (or a list of stages (expm_tol, eps,
+    optimizer tol), see PRECISION_STAGES), the optimizer first runs
+    on coarse approximations of the cost (state truncation, and fewer
+    uniformization terms if method='action'), which are refined
+    whenever it converges at the tolerance of the stage, before the
+    final run at full accuracy. The estimated error of every stage
+    (the change of the cost at its solution when refined) is then
+    reported in the full output.
+    If starts > 1, the optimizer runs from that many starting
+    points (see starting_points), concurrently if an executor
+    (see parallel.make_executor) is given, and the best solution
+    is kept; callback is then not called.
     """
         
     N = len(EB)
@@ -126,32 +806,61 @@ def optimal_schedule(EB, SCV, omega, fixed_inter_times, tau, k=1, u=0):
 
     if N == 1 and (k,u) == (1,0):  # system is idle, one client to schedule
         if not m:  ### TODO: redundant?
-            return np.array([tau]), 0
+            return (np.array([tau]), 0, {}) if full_output else (np.array([tau]), 0)
+
+    problem = ScheduleProblem.create(EB, SCV, omega, fixed_inter_times, k, u, method, expm_tol, eps)
 
-    u_full = [u] + [0] * (N - 1)
-    gamma, T = zip(*[phase_parameters(EB[i], SCV[i], u_full[i]) for i in range(N)])
-    Vn = create_Vn(gamma, T)
-    Vn_inv = inv(Vn)
-    
     # initial guess minimization
-    if m:
-        x0 = np.array([tau] + [EB[i] for i in range(k+1+m,N)])
-        lower_bounds = [tau] + [0] * (N-k-m-1)
+    x_init, lower_bounds = initial_guess(EB, fixed_inter_times, tau, k)
+
+    if x0 is None or len(x0) != len(x_init):
+        x0 = x_init
     else:
-        x0 = np.array([EB[0] + k] + [EB[i] for i in range(k+1,N)])
-        lower_bounds = [tau] + [0] * (N-k-1)
+        x0 = np.maximum(x0, lower_bounds)
     
-    lin_cons = LinearConstraint(np.eye(N - k - m), lower_bounds, np.inf)
-    cost_fun = lambda x: cost(x, EB, gamma, Vn, Vn_inv, omega, k, fixed_inter_times)
     tol = None if N <= 30 else 1e-4
-    optim = minimize(cost_fun, x0, constraints=lin_cons, method='SLSQP', tol=tol)
-    inter_times, optimal_cost = optim.x, optim.fun
+    stages = PRECISION_STAGES if precision == 'adaptive' else precision or []
 
-    inter_times = np.concatenate((fixed_inter_times, inter_times))
+    if starts is None or starts == 1:
+        optim, stage_info = _optimize(problem, x0, lower_bounds, stages, solver, tol, maxiter, callback)
+        start_info = None
 
-    if (k,u) == (1,0):  # system is idle
-        inter_times = np.pad(inter_times, (1,0))
+    else:  # multi-start, every start on its own copy of the problem (with its own buffers)
+        candidates = starting_points(x_init, lower_bounds, starts, x0)
+        args = [(problem.with_precision(problem.tol, problem.eps), x, lower_bounds, stages, solver, tol, maxiter)
+                for x in candidates]
+        if executor is None:
+            results = [_optimize(*a) for a in args]
+        else:
+            task = metrics.bind(_optimize) if isinstance(executor, ThreadPoolExecutor) else _optimize
+            with pool_blas_threads(executor):
+                results = list(executor.map(task, *zip(*args)))
+        best = int(np.argmin([optim.fun for optim, _ in results]))
+        optim, stage_info = results[best]
+        start_info = {'costs': [float(optim.fun) for optim, _ in results], 'best': best}
+
+    schedule, optimal_cost = to_schedule(optim.x, fixed_inter_times, k, u), optim.fun
 
-    schedule = np.cumsum(inter_times)
+    if full_output:
+        info = {'solver': optim.method, 'nit': optim.nit, 'nfev': optim.nfev, 'njev': optim.njev,
+                'wall_time': optim.wall_time, 'success': optim.success, 'message': optim.message}
+        if stages:
+            info['stages'] = stage_info
+        if start_info:
+            info['starts'] = start_info
+        problem.evaluate(optim.x)
+        info.update(problem.info())
+        return schedule, optimal_cost, info
 
     return schedule, optimal_cost
+
+
+def free_inter_times(schedule, k, u, m=0):
+    """
+    Returns the interarrival times of the clients to be
+    scheduled, given a schedule returned by optimal_schedule.
+    """
+
+    skip = m + int((k,u) == (1,0))
+
+    return np.diff(np.concatenate(([0], schedule)))[skip:]
@@ -0,0 +1,91 @@
+import os
+import numpy as np
+
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from threadpoolctl import threadpool_limits
+
+import metrics  # instrumentation
+
+
+BLAS_ENV_VARS = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'BLIS_NUM_THREADS',
+                 'VECLIB_MAXIMUM_THREADS', 'NUMEXPR_NUM_THREADS')
+
+
+@contextmanager
+def blas_threads(n):
+    """
+    Limits the number of BLAS threads of the BLAS libraries loaded in
+    this process to n in its body, such that workers running BLAS calls
+    concurrently do not oversubscribe the cores.
+    """
+
+    with threadpool_limits(limits=n):
+        yield
+
+
+def _init_worker(n):
+
+    # the environment variables only affect libraries that a spawned worker loads afterwards,
+    # threadpool_limits those already loaded (e.g. inherited by a forked worker)
+    os.environ.update({var: str(n) for var in BLAS_ENV_VARS})
+    threadpool_limits(limits=n)
+
+
+def worker_blas_threads(workers):
+    """
+    Returns the number of BLAS threads per worker of a pool.
+    """
+
+    return max(1, (os.cpu_count() or 1) // workers)
+
+
+def make_executor(kind='thread', workers=None):
+    """
+    Returns a thread or process pool with the given number of workers
+    (by default the number of cores). The BLAS threads of process
+    workers are limited at startup, those of thread workers by
+    blas_threads around their use (see pool_blas_threads).
+    """
+
+    workers = workers or os.cpu_count() or 1
+
+    if kind == 'thread':
+        return ThreadPoolExecutor(workers)
+    if kind == 'process':
+        return ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(worker_blas_threads(workers),))
+
+    raise ValueError(f'Unknown executor {kind!r}.')
+
+
+@contextmanager
+def pool_blas_threads(executor):
+    """
+    Limits the BLAS threads of this process while the workers of a
+    thread pool run concurrently (process workers are limited by
+    make_executor).
+    """
+
+    if isinstance(executor, ThreadPoolExecutor):
+        with blas_threads(worker_blas_threads(executor._max_workers)):
+            yield
+    else:
+        yield
+
+
+def fd_gradient(f, x, executor, step=None):
+    """
+    Returns f(x) and the forward difference approximation of the
+    gradient of f at x, evaluating the len(x)+1 points concurrently.
+    """
+
+    x = np.asarray(x, dtype=float)
+    step = np.sqrt(np.finfo(float).eps) if step is None else step
+    h = step * np.maximum(1, np.abs(x))
+    points = [x] + [x + h[i] * np.eye(len(x))[i] for i in range(len(x))]
+
+    f = metrics.bind(f) if isinstance(executor, ThreadPoolExecutor) else f
+    with pool_blas_threads(executor):
+        values = list(executor.map(f, points))
+
+    return values[0], (np.array(values[1:]) - values[0]) / h
@@ -0,0 +1,133 @@
+import argparse
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from new_adaptive_scheduling import ScheduleProblem, optimal_schedule, free_inter_times
+from schedule_table import interpolation_weights
+
+
+# elapsed service times of the client in service, in units of its mean
+U_GRID = [0, 0.1, 0.25, 0.5, 0.75, 1, 1.25, 1.5, 2, 2.5, 3]
+
+
+def _sweep(EB, SCV, omega, remaining, k, us):
+    """
+    Solves all u grid points of one (remaining, k) cell, i.e. the clients
+    N-remaining,...,N-1 of the session of which k are in the system,
+    warm-starting every solve from its neighbour in u.
+    """
+
+    EB, SCV = EB[-remaining:], SCV[-remaining:]
+    x = np.full((len(us), remaining - k), np.nan)
+    cost = np.full(len(us), np.nan)
+
+    x0 = None
+    for b, u in enumerate(us):
+        schedule, cost[b] = optimal_schedule(EB, SCV, omega, [], 0, k, u * EB[0], x0=x0)
+        x[b] = x0 = free_inter_times(schedule, k, u * EB[0])
+
+    return remaining, k, x, cost
+
+
+class SchedulePolicy:
+    """
+    Precomputed rescheduling policy of a session with means EB, SCVs SCV
+    and weight omega: the optimal interarrival times of the clients still
+    to be scheduled for every number of remaining clients (including the
+    one in service), every number k of clients in the system and a grid
+    of elapsed service times u (in units of the mean of the client in
+    service), such that rescheduling at an epoch is a lookup with
+    linear interpolation in u.
+    """
+
+    def __init__(self, EB, SCV, omega, us, x, cost):
+
+        self.EB = np.asarray(EB, dtype=float)
+        self.SCV = np.asarray(SCV, dtype=float)
+        self.omega = float(omega)
+        self.u = np.asarray(us, dtype=float)
+        self.x = x  # shape (N+1,N,len(u),N)
+        self.cost = cost  # shape (N+1,N,len(u))
+
+    @classmethod
+    def build(cls, EB, SCV, omega, us=U_GRID, processes=None):
+        """
+        Solves all (remaining, k, u) grid points in parallel.
+        """
+
+        N = len(EB)
+        EB, SCV, us = list(EB), list(SCV), list(us)
+        x = np.full((N + 1, N, len(us), N), np.nan)
+        cost = np.full((N + 1, N, len(us)), np.nan)
+
+        tasks = [(remaining, k) for remaining in range(2, N + 1) for k in range(1, remaining)]
+        with ProcessPoolExecutor(processes) as pool:
+            futures = [pool.submit(_sweep, EB, SCV, omega, remaining, k, us) for remaining, k in tasks]
+            for future in futures:
+                remaining, k, x_cell, cost_cell = future.result()
+                x[remaining,k,:,:remaining-k] = x_cell
+                cost[remaining,k] = cost_cell
+
+        return cls(EB, SCV, omega, us, x, cost)
+
+    def save(self, path):
+
+        np.savez_compressed(path, EB=self.EB, SCV=self.SCV, omega=self.omega, u=self.u, x=self.x, cost=self.cost)
+
+    @classmethod
+    def load(cls, path):
+
+        data = np.load(path)
+        return cls(data['EB'], data['SCV'], data['omega'], data['u'], data['x'], data['cost'])
+
+    def lookup(self, remaining, k, u, tau=0, polish=False, maxiter=5):
+        """
+        Returns the (interpolated) schedule and cost in the format of
+        optimal_schedule for the last remaining clients of the session,
+        of which k are in the system and the first has been in service
+        for u time units, or None if u lies beyond the grid. If tau
+        exceeds the first interarrival time, the schedule is clipped and
+        its cost evaluated exactly. If polish, the interpolated schedule
+        is improved by at most maxiter warm-started optimizer iterations.
+        """
+
+        N = len(self.EB)
+        if not 2 <= remaining <= N or not 1 <= k < remaining:
+            return None
+
+        mean = self.EB[N-remaining]
+        weights = interpolation_weights(self.u, u / mean)
+        if weights is None:
+            return None
+
+        (a, b), (wa, wb) = weights
+        x = wa * self.x[remaining,k,a,:remaining-k] + wb * self.x[remaining,k,b,:remaining-k]
+        cost = float(wa * self.cost[remaining,k,a] + wb * self.cost[remaining,k,b])
+        if tau > x[0]:  # the interpolated cost is that of the unclipped schedule
+            x[0] = tau
+            cost = ScheduleProblem.create(list(self.EB[-remaining:]), list(self.SCV[-remaining:]), self.omega, [],
+                                          k, u).evaluate(x)
+
+        if polish:
+            return optimal_schedule(list(self.EB[-remaining:]), list(self.SCV[-remaining:]), self.omega, [], tau,
+                                    k, u, x0=x, maxiter=maxiter)
+
+        if (k,u) == (1,0):  # system is idle
+            x = np.pad(x, (1,0))
+
+        return np.cumsum(x), cost
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Precomputes the rescheduling policy of a session.')
+    parser.add_argument('path', help='output file (.npz)')
+    parser.add_argument('--EB', type=float, nargs='+', required=True)
+    parser.add_argument('--SCV', type=float, nargs='+', required=True)
+    parser.add_argument('--omega', type=float, required=True)
+    parser.add_argument('--u', type=float, nargs='+', default=U_GRID)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    SchedulePolicy.build(args.EB, args.SCV, args.omega, args.u, args.processes).save(args.path)
@@ -0,0 +1,222 @@
+import os, json, time, sqlite3, hashlib, inspect, tempfile, threading
+import numpy as np
+
+from collections import OrderedDict
+from contextlib import closing
+
+from new_adaptive_scheduling import optimal_schedule, free_inter_times
+import metrics  # instrumentation
+
+
+# configuration (shared by all gunicorn workers through the environment)
+CACHE_PATH = os.environ.get('SCHEDULE_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'adaptive_schedule_cache.sqlite'))
+CACHE_DECIMALS = int(os.environ.get('SCHEDULE_CACHE_DECIMALS', 6))
+CACHE_MEMORY_SIZE = int(os.environ.get('SCHEDULE_CACHE_MEMORY_SIZE', 256))
+CACHE_MAX_ENTRIES = int(os.environ.get('SCHEDULE_CACHE_MAX_ENTRIES', 100000))
+CACHE_MAX_AGE = float(os.environ.get('SCHEDULE_CACHE_MAX_AGE', 30 * 24 * 3600))  # seconds
+
+# options of optimal_schedule that change the result (e.g. approximations), with their defaults
+KEY_OPTIONS = {name: p.default for name, p in inspect.signature(optimal_schedule).parameters.items()
+               if p.default is not p.empty and name not in ('k', 'u', 'x0', 'callback', 'full_output', 'executor')}
+
+
+class ScheduleCache:
+    """
+    Two-tier cache of optimal schedules: an in-process LRU tier and an
+    on-disk SQLite tier that is shared by all worker processes. Entries
+    are keyed on the normalized (EB, SCV, omega, fixed_inter_times, tau,
+    k, u), rounded to the given number of decimals, and the options of
+    optimal_schedule that differ from their defaults (KEY_OPTIONS).
+    Entries are evicted from both tiers when they are older than max_age
+    seconds, or when a tier holds too many schedules (least recently
+    used first).
+    If path is None, only the in-process tier is used.
+    """
+
+    def __init__(self, path=CACHE_PATH, decimals=CACHE_DECIMALS, memory_size=CACHE_MEMORY_SIZE,
+                 max_entries=CACHE_MAX_ENTRIES, max_age=CACHE_MAX_AGE):
+
+        self.path = path
+        self.decimals = decimals
+        self.memory_size = memory_size
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.memory = OrderedDict()
+        self._lock = threading.Lock()  # guards memory, which request and job threads share
+
+        if path is not None:
+            with closing(self._connect()) as con, con:
+                con.execute('PRAGMA journal_mode=WAL')
+                con.execute('CREATE TABLE IF NOT EXISTS schedules (key TEXT PRIMARY KEY, shape TEXT, '
+                            'params TEXT, schedule TEXT, cost REAL, created REAL, accessed REAL)')
+                con.execute('CREATE INDEX IF NOT EXISTS schedules_shape ON schedules (shape, accessed)')
+
+    def _connect(self):
+
+        # one connection per operation, such that the cache is safe across forks and threads
+        return sqlite3.connect(self.path, timeout=30)
+
+    def normalize(self, EB, SCV, omega, fixed_inter_times, tau, k, u, **options):
+        """
+        Returns the cache key, the shape of the problem (only problems
+        of equal shape and options have interchangeable solutions), and
+        the rounded parameters as a flat vector. Options that do not
+        change the result (such as x0 and callback) are ignored.
+        """
+
+        r = lambda v: [float(i) + 0 for i in np.round(np.atleast_1d(np.asarray(v, dtype=float)), self.decimals)]
+        params = [r(EB), r(SCV), r(omega), r(fixed_inter_times), r(tau), [int(k)], r(u)]
+        shape = f'{len(EB)}:{int(k)}:{len(fixed_inter_times)}:{int((k,u) == (1,0))}'
+
+        options = {name: value for name, value in sorted(options.items())
+                   if name in KEY_OPTIONS and value != KEY_OPTIONS[name]}
+        if options:  # keys of the default options are unchanged
+            options = json.dumps(options, default=repr)
+            shape += ':' + hashlib.sha1(options.encode()).hexdigest()[:12]
+            key = hashlib.sha1(json.dumps(params + [options]).encode()).hexdigest()
+        else:
+            key = hashlib.sha1(json.dumps(params).encode()).hexdigest()
+
+        return key, shape, sum(params, [])
+
+    def get(self, key):
+        """
+        Returns the cached (schedule, cost) or None.
+        """
+
+        with self._lock:
+            entry = self.memory.get(key)
+            if entry is not None and entry[4] < time.time() - self.max_age:
+                del self.memory[key]
+                entry = None
+            if entry is not None:
+                self.memory.move_to_end(key)
+                return entry[2:4]
+
+        if self.path is None:
+            return None
+
+        with closing(self._connect()) as con, con:
+            row = con.execute('SELECT shape, params, schedule, cost, created FROM schedules WHERE key = ?',
+                              (key,)).fetchone()
+            if row is None or row[4] < time.time() - self.max_age:
+                return None
+            con.execute('UPDATE schedules SET accessed = ? WHERE key = ?', (time.time(), key))
+
+        entry = (row[0], json.loads(row[1]), np.array(json.loads(row[2])), row[3], row[4])
+        self._remember(key, entry)
+
+        return entry[2:4]
+
+    def put(self, key, shape, params, schedule, cost):
+        """
+        Stores a schedule in both tiers and evicts stale entries. Failed
+        results (a non-finite schedule or cost) are not stored.
+        """
+
+        schedule, cost = np.asarray(schedule, dtype=float), float(cost)
+        if not np.isfinite(cost) or not np.all(np.isfinite(schedule)):
+            return
+
+        now = time.time()
+        self._remember(key, (shape, params, schedule, cost, now))
+
+        if self.path is None:
+            return
+
+        with closing(self._connect()) as con, con:
+            con.execute('INSERT OR REPLACE INTO schedules VALUES (?, ?, ?, ?, ?, ?, ?)',
+                        (key, shape, json.dumps(params), json.dumps(schedule.tolist()), cost, now, now))
+            self._evict(con, now)
+
+    def _remember(self, key, entry):
+
+        with self._lock:
+            self.memory[key] = entry
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.memory_size:
+                self.memory.popitem(last=False)
+
+    def _evict(self, con, now):
+
+        con.execute('DELETE FROM schedules WHERE created < ?', (now - self.max_age,))
+        excess = con.execute('SELECT COUNT(*) FROM schedules').fetchone()[0] - self.max_entries
+        if excess > 0:
+            con.execute('DELETE FROM schedules WHERE key IN '
+                        '(SELECT key FROM schedules ORDER BY accessed LIMIT ?)', (excess,))
+
+    def nearest(self, shape, params, limit=256):
+        """
+        Returns the cached schedule of the same shape whose parameters
+        are closest (in Euclidean distance) to params, or None.
+        """
+
+        with self._lock:
+            candidates = [entry[1:3] for entry in self.memory.values()
+                          if entry[0] == shape and entry[4] >= time.time() - self.max_age]
+
+        if self.path is not None:
+            with closing(self._connect()) as con:
+                rows = con.execute('SELECT params, schedule FROM schedules WHERE shape = ? AND created >= ? '
+                                   'ORDER BY accessed DESC LIMIT ?',
+                                   (shape, time.time() - self.max_age, limit)).fetchall()
+            candidates += [(json.loads(p), np.array(json.loads(s))) for p, s in rows]
+
+        if not candidates:
+            return None
+
+        distances = [np.linalg.norm(np.subtract(p, params)) for p, _ in candidates]
+
+        return candidates[int(np.argmin(distances))][1]
+
+    def clear(self):
+
+        with self._lock:
+            self.memory.clear()
+        if self.path is not None:
+            with closing(self._connect()) as con, con:
+                con.execute('DELETE FROM schedules')
+
+
+_default_cache = None
+
+def default_cache():
+    """
+    Returns the cache configured through the SCHEDULE_CACHE_* environment variables.
+    """
+
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ScheduleCache()
+
+    return _default_cache
+
+
+def cached_schedule(EB, SCV, omega, fixed_inter_times, tau, k=1, u=0, cache=None, **kwargs):
+    """
+    Drop-in replacement for optimal_schedule that serves repeated
+    requests from the cache. On a miss, the closest cached schedule
+    of the same shape seeds the optimizer. The info of full_output is
+    not cached, so such requests are always computed (and their
+    schedule and cost stored).
+    """
+
+    cache = default_cache() if cache is None else cache
+    key, shape, params = cache.normalize(EB, SCV, omega, fixed_inter_times, tau, k, u, **kwargs)
+
+    hit = None if kwargs.get('full_output') else cache.get(key)
+    if hit is not None:
+        metrics.count('cache_hits')
+        schedule, cost = hit
+        return schedule.copy(), cost
+    metrics.count('cache_misses')
+
+    # interarrival times of the clients to be scheduled of the closest schedule
+    near = cache.nearest(shape, params)
+    if near is not None:
+        kwargs.setdefault('x0', free_inter_times(near, k, u, len(fixed_inter_times)))
+
+    output = optimal_schedule(EB, SCV, omega, fixed_inter_times, tau, k, u, **kwargs)
+    cache.put(key, shape, params, *output[:2])
+
+    return output
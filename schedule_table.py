@@ -0,0 +1,148 @@
+import os, json, argparse
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor
+
+from new_adaptive_scheduling import ScheduleProblem, optimal_schedule, free_inter_times
+
+
+# default grid (service times are scaled to mean 1, u in units of the mean)
+N_MAX = 20
+SCV_GRID = [0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0, 1.2, 1.5, 2.0]
+OMEGA_GRID = [0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9]
+U_GRID = [0, 0.25, 0.5, 1, 1.5, 2, 3]
+
+
+def _sweep(n, k, SCV, omegas, us):
+    """
+    Solves all (omega, u) grid points of one (n, k, SCV) cell,
+    warm-starting every solve from its neighbour in u.
+    """
+
+    x = np.full((len(omegas), len(us), n - k), np.nan)
+    cost = np.full((len(omegas), len(us)), np.nan)
+
+    for a, omega in enumerate(omegas):
+        x0 = None
+        for b, u in enumerate(us):
+            schedule, cost[a,b] = optimal_schedule([1] * n, [SCV] * n, omega, [], 0, k, u, x0=x0)
+            x[a,b] = x0 = free_inter_times(schedule, k, u)
+
+    return n, k, SCV, x, cost
+
+
+def build_table(path, n_max=N_MAX, SCVs=SCV_GRID, omegas=OMEGA_GRID, us=U_GRID, processes=None):
+    """
+    Sweeps optimal_schedule over all n <= n_max, 1 <= k < n and the
+    SCV, omega and u grids for homogeneous clients with mean 1, and
+    writes the optimal interarrival times and costs to memory-mapped
+    arrays in the directory path.
+    """
+
+    SCVs, omegas, us = list(SCVs), list(omegas), list(us)
+    os.makedirs(path, exist_ok=True)
+    grid = {'n_max': n_max, 'SCV': SCVs, 'omega': omegas, 'u': us}
+    with open(os.path.join(path, 'grid.json'), 'w') as f:
+        json.dump(grid, f)
+
+    shape = (n_max + 1, n_max, len(SCVs), len(omegas), len(us))
+    x_table = np.lib.format.open_memmap(os.path.join(path, 'x.npy'), mode='w+', shape=shape + (n_max,))
+    cost_table = np.lib.format.open_memmap(os.path.join(path, 'cost.npy'), mode='w+', shape=shape)
+    x_table[:] = np.nan
+    cost_table[:] = np.nan
+
+    tasks = [(n, k, SCV) for n in range(2, n_max + 1) for k in range(1, n) for SCV in SCVs]
+    with ProcessPoolExecutor(processes) as pool:
+        futures = [pool.submit(_sweep, n, k, SCV, omegas, us) for n, k, SCV in tasks]
+        for future in futures:
+            n, k, SCV, x, cost = future.result()
+            s = SCVs.index(SCV)
+            x_table[n,k,s,:,:,:n-k] = x
+            cost_table[n,k,s] = cost
+
+    x_table.flush()
+    cost_table.flush()
+
+
+def interpolation_weights(grid, value):
+    """
+    Returns the indices and weights of the two grid points
+    surrounding value, or None if value lies outside the grid.
+    """
+
+    if not grid[0] <= value <= grid[-1]:
+        return None
+
+    j = min(max(np.searchsorted(grid, value) - 1, 0), len(grid) - 2)
+    w = (value - grid[j]) / (grid[j+1] - grid[j])
+
+    return (j, j + 1), (1 - w, w)
+
+
+class ScheduleTable:
+    """
+    Lookup of optimal schedules for homogeneous clients from a table
+    written by build_table, by multilinear interpolation in SCV, omega
+    and u. Only the eight surrounding grid points are read from disk.
+    """
+
+    def __init__(self, path):
+
+        with open(os.path.join(path, 'grid.json')) as f:
+            grid = json.load(f)
+
+        self.n_max = grid['n_max']
+        self.SCV = np.array(grid['SCV'])
+        self.omega = np.array(grid['omega'])
+        self.u = np.array(grid['u'])
+        self.x = np.load(os.path.join(path, 'x.npy'), mmap_mode='r')
+        self.cost = np.load(os.path.join(path, 'cost.npy'), mmap_mode='r')
+
+    def lookup(self, n, mean, SCV, omega, tau=0, k=1, u=0, refine=False, maxiter=5):
+        """
+        Returns the (interpolated) schedule and cost in the format
+        of optimal_schedule for n clients with equal mean and SCV,
+        or None if the parameters lie outside the table. If tau exceeds
+        the first interarrival time, the schedule is clipped and its cost
+        evaluated exactly. If refine, the interpolated schedule is
+        improved by at most maxiter warm-started optimizer iterations.
+        """
+
+        if not 2 <= n <= self.n_max or not 1 <= k < n:
+            return None
+
+        axes = [interpolation_weights(self.SCV, SCV), interpolation_weights(self.omega, omega),
+                interpolation_weights(self.u, u / mean)]
+        if None in axes:
+            return None
+
+        (s, o, v), (ws, wo, wv) = zip(*axes)
+        W = np.einsum('i,j,l->ijl', ws, wo, wv)
+        idx = np.ix_(s, o, v)
+        x = np.einsum('ijl,ijlm->m', W, self.x[n,k][idx][...,:n-k]) * mean
+        cost = float(np.sum(W * self.cost[n,k][idx])) * mean
+        if tau > x[0]:  # the interpolated cost is that of the unclipped schedule
+            x[0] = tau
+            cost = ScheduleProblem.create([mean] * n, [SCV] * n, omega, [], k, u).evaluate(x)
+
+        if refine:
+            return optimal_schedule([mean] * n, [SCV] * n, omega, [], tau, k, u, x0=x, maxiter=maxiter)
+
+        if (k,u) == (1,0):  # system is idle
+            x = np.pad(x, (1,0))
+
+        return np.cumsum(x), cost
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Builds the schedule table for homogeneous clients.')
+    parser.add_argument('path', help='output directory')
+    parser.add_argument('--n-max', type=int, default=N_MAX)
+    parser.add_argument('--SCV', type=float, nargs='+', default=SCV_GRID)
+    parser.add_argument('--omega', type=float, nargs='+', default=OMEGA_GRID)
+    parser.add_argument('--u', type=float, nargs='+', default=U_GRID)
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    build_table(args.path, args.n_max, args.SCV, args.omega, args.u, args.processes)
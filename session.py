@@ -0,0 +1,140 @@
+import numpy as np
+
+from api import problem
+from new_adaptive_scheduling import ScheduleProblem, optimal_schedule, free_inter_times
+import metrics  # instrumentation
+
+
+class Session:
+    """
+    A live session of clients with means EB and SCVs SCV (in order of
+    service) and weight omega, driven by arrival and service completion
+    events at absolute times (e.g. minutes since the opening at time
+    start). It keeps the number k of clients in the system, the elapsed
+    service time u of the client in service and the planned appointment
+    times of the clients that have not arrived yet, and reschedules
+    them on demand. Every rescheduling is warm-started from the previous
+    plan, shifted to the current state, and the phase fits of the clients
+    still to come are reused (see phase_fit). Vn is assembled anew at
+    every event, as u changes, but this is a small part of an update,
+    which is dominated by the optimizer. The keyword arguments are
+    passed to optimal_schedule.
+    """
+
+    def __init__(self, EB, SCV, omega, start=0, **kwargs):
+
+        if len(EB) != len(SCV):
+            raise ValueError('EB and SCV must have the same length.')
+        if not np.all(np.isfinite(list(EB) + list(SCV))) or min(list(EB) + list(SCV), default=1) <= 0:
+            raise ValueError('The means and SCVs must be positive and finite.')
+        if not 0 < omega < 1:
+            raise ValueError('omega must lie in (0,1).')
+
+        self.EB, self.SCV, self.omega = [float(i) for i in EB], [float(i) for i in SCV], float(omega)
+        self.kwargs = kwargs
+        self.now = float(start)
+        self.arrived = 0  # clients that have arrived
+        self.completed = 0  # clients whose service is completed
+        self.service_start = None  # start of the current service
+        self.plan = np.full(len(EB), np.nan)  # appointment times of the clients that have not arrived
+        self.cost = None
+
+    @property
+    def k(self):
+        return self.arrived - self.completed
+
+    @property
+    def u(self):
+        return self.now - self.service_start if self.k else 0
+
+    def _advance(self, time):
+
+        if time < self.now:
+            raise ValueError(f'Events must be in chronological order ({time} < {self.now}).')
+        self.now = float(time)
+
+    def arrive(self, time):
+        """
+        Records the arrival of the next client at time.
+        """
+
+        if self.arrived == len(self.EB):
+            raise ValueError('All clients have arrived.')
+
+        self._advance(time)
+        self.arrived += 1
+        if self.k == 1:  # the system was idle
+            self.service_start = self.now
+
+    def complete(self, time):
+        """
+        Records the service completion of the client in service at time,
+        after which the next client in the system (if any) is served.
+        """
+
+        if not self.k:
+            raise ValueError('No client is in service.')
+
+        self._advance(time)
+        self.completed += 1
+        self.service_start = self.now if self.k else None
+
+    def reschedule(self, time=None, fixed=0, tau=0, maxiter=None):
+        """
+        Computes the optimal appointment times of the clients that have
+        not arrived yet at time (by default that of the last event),
+        given the current state. The next fixed clients keep their
+        planned appointment times (e.g. as they have been notified),
+        and the first other client is scheduled at least tau time units
+        from now. Returns the appointment times and the expected cost
+        of the rest of the session. If all clients are fixed, the plan
+        is kept and only its cost is evaluated.
+        """
+
+        pending = len(self.EB) - self.arrived
+        if fixed != int(fixed) or not 0 <= fixed <= pending:
+            raise ValueError(f'fixed must be an integer between 0 and the number of pending clients ({pending}).')
+        if not tau >= 0:
+            raise ValueError('tau must be non-negative.')
+        fixed = int(fixed)
+
+        if time is not None:
+            self._advance(time)
+
+        if not pending:
+            self.cost = 0.0
+            return np.array([]), self.cost
+
+        planned = self.plan[self.arrived:]
+        if fixed and np.isnan(planned[:fixed]).any():
+            raise ValueError('Only planned appointments can be fixed.')
+        fixed_t = list(np.maximum.accumulate(np.maximum(planned[:fixed] - self.now, 0)))
+        tau = max(tau, fixed_t[-1]) if fixed_t else tau
+
+        c = self.completed
+        spec = problem(self.omega, len(self.EB) - c, self.EB[c:], self.SCV[c:], self.k, self.u, fixed_t, tau)
+        args = spec['args']
+        k, u, m = args[5], args[6], len(args[3])
+        in_service = self.k and (k,u) == (1,0)  # the schedule includes the client who just started service
+
+        if fixed == pending:  # no free interarrival times
+            options = {key: self.kwargs[key] for key in ('method', 'eps') if key in self.kwargs}
+            model = ScheduleProblem.create(*args[:4], k, u, **options)
+            self.plan[self.arrived:] = self.now + np.array(fixed_t)
+            self.cost = float(model.evaluate(np.array([]))) + spec['cost_shift']
+            return self.plan[self.arrived:].copy(), self.cost
+
+        # the previous plan in the time frame of the problem
+        x0 = None
+        if not np.isnan(planned).any():
+            guess = planned - self.now - spec['t_shift']
+            x0 = free_inter_times(np.pad(guess, (1,0)) if in_service else guess, k, u, m)
+
+        with metrics.request('session'):
+            schedule, cost = optimal_schedule(*args, x0=x0, maxiter=maxiter, **self.kwargs)
+
+        schedule = np.asarray(schedule)[1:] if in_service else np.asarray(schedule)
+        self.plan[self.arrived:] = schedule + spec['t_shift'] + self.now
+        self.cost = float(cost) + spec['cost_shift']
+
+        return self.plan[self.arrived:].copy(), self.cost
@@ -0,0 +1,229 @@
+import math
+import numpy as np
+
+from scipy.stats import norm
+from concurrent.futures import ProcessPoolExecutor
+
+from new_adaptive_scheduling import phase_parameters
+
+
+# service time samplers: sampler(rng, size) returns iid service times,
+# sampler.residual(rng, size, u) the remaining service times given that
+# u time units have elapsed (optional, otherwise by rejection)
+
+class PhaseType:
+    """
+    The phase-type fit of phase_parameters (weighted Erlang if SCV < 1,
+    hyperexponential otherwise), i.e. the model that cost evaluates.
+    """
+
+    def __init__(self, mean, SCV):
+
+        self.mean = mean
+        self.SCV = SCV
+
+    def _phases(self, rng, size, u):
+
+        # number of phases still to complete (Erlang) or phase rate (hyperexponential)
+        gamma, T = phase_parameters(self.mean, self.SCV, u)
+        d = T.shape[0]
+        z = rng.choice(d, size=size, p=gamma[0] / np.sum(gamma[0]))
+
+        if self.SCV < 1:
+            mu = -T[0,0]
+            q = T[d-2,d-1] / mu  # probability of the last phase
+            K = d - 1
+            phases = np.where(z < K, K - z + (rng.random(size) < q), 1)
+            return rng.gamma(phases, 1 / mu)
+
+        return rng.exponential(1 / -np.diag(T)[z])
+
+    def __call__(self, rng, size):
+
+        return self._phases(rng, size, 0)
+
+    def residual(self, rng, size, u):
+
+        return self._phases(rng, size, u)
+
+
+class Lognormal:
+    """
+    Lognormal service times with the given mean and SCV.
+    """
+
+    def __init__(self, mean, SCV):
+
+        self.sigma = math.sqrt(math.log(1 + SCV))
+        self.mu = math.log(mean) - self.sigma**2 / 2
+
+    def __call__(self, rng, size):
+
+        return rng.lognormal(self.mu, self.sigma, size)
+
+
+class Pareto:
+    """
+    Heavy-tailed (Lomax) service times with the given mean and SCV > 1.
+    """
+
+    def __init__(self, mean, SCV):
+
+        if SCV <= 1:
+            raise ValueError('The Pareto distribution requires SCV > 1.')
+
+        self.alpha = 2 * SCV / (SCV - 1)
+        self.scale = mean * (self.alpha - 1)
+
+    def __call__(self, rng, size):
+
+        return self.scale * rng.pareto(self.alpha, size)
+
+
+class Empirical:
+    """
+    Service times resampled from observed data.
+    """
+
+    def __init__(self, data):
+
+        self.data = np.asarray(data, dtype=float)
+
+    def __call__(self, rng, size):
+
+        return rng.choice(self.data, size)
+
+    def residual(self, rng, size, u):
+
+        data = self.data[self.data > u]
+        if not len(data):
+            raise ValueError(f'No observed service time exceeds u = {u}.')
+
+        return rng.choice(data, size) - u
+
+
+def residual(sampler, rng, size, u, max_rounds=1000):
+    """
+    Samples the remaining service times given that u time units
+    have elapsed, by sampler.residual if available, and by
+    rejection otherwise.
+    """
+
+    if u == 0:
+        return sampler(rng, size)
+    if hasattr(sampler, 'residual'):
+        return sampler.residual(rng, size, u)
+
+    B = np.full(size, np.nan)
+    todo = np.arange(size)
+    for _ in range(max_rounds):
+        draws = sampler(rng, len(todo))
+        accept = draws > u
+        B[todo[accept]] = draws[accept] - u
+        todo = todo[~accept]
+        if not len(todo):
+            return B
+
+    raise ValueError(f'Rejection sampling of the residual service time failed for u = {u}.')
+
+
+def arrival_times(schedule, k, u):
+    """
+    Returns the arrival times of all clients, including the k
+    clients in the system, given a schedule returned by
+    optimal_schedule (a stack of schedules of shape (S,n) is allowed).
+    """
+
+    schedule = np.atleast_2d(np.asarray(schedule, dtype=float))
+    if (k,u) == (1,0):  # system is idle, the schedule includes the first client
+        return schedule
+
+    return np.hstack((np.zeros((len(schedule),k)), schedule))
+
+
+def _simulate_chunk(t, samplers, u, omega, reps, seed):
+    """
+    Simulates reps sessions for every row of arrival times t (shape
+    (S,N)) on the same service times, and returns the sums and sums
+    of squares of the idle times, waiting times and costs.
+    """
+
+    rng = np.random.default_rng(seed)
+    N = t.shape[1]
+
+    B = np.empty((reps, N))
+    B[:,0] = residual(samplers[0], rng, reps, u)
+    if N > 1 and all(sampler is samplers[1] for sampler in samplers[1:]):
+        B[:,1:] = samplers[1](rng, (reps, N - 1))
+    else:
+        for i in range(1, N):
+            B[:,i] = samplers[i](rng, reps)
+
+    # Lindley recursion C[i] = max(C[i-1], t[i]) + B[i], unrolled as
+    # C[i] = S[i] + max_{j <= i} (t[j] - S[j-1]) with S the cumulative service
+    S = np.cumsum(B, axis=1)
+    S_prev = S - B
+
+    sums = []
+    for t_s in t:
+        C = S + np.maximum.accumulate(t_s - S_prev, axis=1)
+        W = (C - B - t_s)[:,1:]
+        I = np.maximum(t_s[1:] - C[:,:-1], 0)
+        costs = omega * np.sum(I, axis=1) + (1 - omega) * np.sum(W, axis=1)
+        sums.append((I.sum(0), (I**2).sum(0), W.sum(0), (W**2).sum(0), costs))
+
+    base = sums[0][4]
+    return [(sI, sI2, sW, sW2, c.sum(), (c**2).sum(), (c - base).sum(), ((c - base)**2).sum())
+            for sI, sI2, sW, sW2, c in sums]
+
+
+def simulate(schedule, k, u, sampler, omega, reps=10**6, seed=0, chunk=2**16, processes=None, level=0.95):
+    """
+    Estimates E[I_i], E[W_i] (i = 1,...,N-1) and the cost of a schedule
+    (as returned by optimal_schedule, with k clients in the system, the
+    first with elapsed service time u) by simulating reps sessions with
+    the service time sampler (one for all clients, or a list with one
+    per client). A stack of schedules is simulated on the same service
+    times (common random numbers), such that their differences in cost
+    are estimated accurately. The work is split into chunks of at most
+    chunk sessions, with random streams derived from seed (independent
+    of processes), which are run by a process pool if processes > 1.
+    Returns a dict of estimates with the half widths of their
+    confidence intervals (at the given level); for a stack, the
+    entries are stacked and cost_diff is the cost minus that of the
+    first schedule.
+    """
+
+    t = arrival_times(schedule, k, u)
+    N = t.shape[1]
+    samplers = sampler if isinstance(sampler, (list, tuple)) else [sampler] * N
+
+    sizes = [chunk] * (reps // chunk) + ([reps % chunk] if reps % chunk else [])
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    args = [(t, samplers, u, omega, size, s) for size, s in zip(sizes, seeds)]
+
+    if processes is not None and processes > 1:
+        with ProcessPoolExecutor(processes) as pool:
+            chunks = list(pool.map(_simulate_chunk, *zip(*args)))
+    else:
+        chunks = [_simulate_chunk(*a) for a in args]
+
+    z = norm.ppf((1 + level) / 2)
+    mean = lambda s: s / reps
+    half_width = lambda s, s2: z * np.sqrt(np.maximum(s2 / reps - (s / reps)**2, 0) / (reps - 1))
+
+    results = []
+    for sums in zip(*chunks):
+        sI, sI2, sW, sW2, sc, sc2, sd, sd2 = [sum(c) for c in zip(*sums)]
+        results.append({'EI': np.pad(mean(sI), (1,0)), 'EI_ci': np.pad(half_width(sI, sI2), (1,0)),
+                        'EW': np.pad(mean(sW), (1,0)), 'EW_ci': np.pad(half_width(sW, sW2), (1,0)),
+                        'cost': mean(sc), 'cost_ci': half_width(sc, sc2),
+                        'cost_diff': mean(sd), 'cost_diff_ci': half_width(sd, sd2)})
+
+    if np.ndim(schedule) == 1:
+        result = {key: value for key, value in results[0].items() if not key.startswith('cost_diff')}
+    else:
+        result = {key: np.array([r[key] for r in results]) for key in results[0]}
+    result['reps'] = reps
+
+    return result
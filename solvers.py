@@ -0,0 +1,159 @@
+import os, json, time
+import numpy as np
+
+import metrics  # instrumentation
+from parallel import fd_gradient
+
+
+# fastest method per problem size (number of free variables), see select_method
+SOLVER_TABLE_PATH = os.environ.get('SCHEDULE_SOLVER_TABLE')
+DEFAULT_METHOD = 'SLSQP'
+
+METHODS = ('SLSQP', 'L-BFGS-B', 'trust-constr', 'projected-newton')
+
+
+def projected_newton(fun, x0, lower, tol=1e-6, maxiter=200, callback=None, sigma=1e-4):
+    """
+    Minimizes fun (returning the value and the gradient) subject to
+    x >= lower by a projected quasi-Newton method (Bertsekas, 1982):
+    variables at their bound with a positive gradient are fixed, the
+    others take a BFGS step, and the step is projected back onto the
+    bounds with an Armijo backtracking line search.
+    """
+
+    from scipy.optimize import OptimizeResult
+
+    x = np.maximum(np.asarray(x0, dtype=float), lower)
+    f, g = fun(x)
+    nfev = 1
+    H = np.eye(len(x))  # inverse Hessian approximation
+    message = 'Maximum number of iterations has been exceeded.'
+
+    for nit in range(1, maxiter + 1):
+
+        # projected gradient
+        if np.max(np.abs(x - np.maximum(lower, x - g))) < tol:
+            message = 'Optimization terminated successfully'
+            nit -= 1
+            break
+
+        active = (x - lower <= 1e-10) & (g > 0)
+        free = ~active
+        d = -g.copy()
+        d[free] = -H[np.ix_(free, free)] @ g[free]
+
+        # projected Armijo line search
+        alpha = 1.0
+        while True:
+            x_new = np.maximum(lower, x + alpha * d)
+            f_new, g_new = fun(x_new)
+            nfev += 1
+            if f_new <= f + sigma * g @ (x_new - x) or alpha < 1e-12:
+                break
+            alpha /= 2
+
+        s, y = x_new - x, g_new - g
+        x, f, g = x_new, f_new, g_new
+
+        if s @ y > 1e-12:  # BFGS update
+            rho = 1 / (s @ y)
+            V = np.eye(len(x)) - rho * np.outer(s, y)
+            H = V @ H @ V.T + rho * np.outer(s, s)
+
+        if callback is not None:
+            callback(x)
+
+        if alpha < 1e-12:
+            message = 'Line search failed.'
+            break
+
+    return OptimizeResult(x=x, fun=f, jac=g, nit=nit, nfev=nfev, njev=nfev,
+                          success=message.startswith('Optimization'), message=message)
+
+
+def solve(fun, x0, lower, method=DEFAULT_METHOD, jac=True, tol=None, maxiter=None, callback=None, executor=None):
+    """
+    Minimizes fun subject to the plain lower bounds x >= lower, which
+    are passed as bounds rather than as linear constraints. If jac,
+    fun returns the value and the gradient, otherwise the gradient is
+    approximated by finite differences. The method is one of METHODS,
+    or 'auto' (see select_method). The result reports the number of
+    iterations, function and gradient evaluations, the wall time and
+    the time spent in fun (the rest is the overhead of the solver).
+    If not jac and an executor (see parallel.make_executor) is given,
+    the finite difference perturbations are evaluated concurrently.
+    """
+
+    from scipy.optimize import minimize, approx_fprime, Bounds, BFGS  # deferred, slow to import
+
+    x0 = np.asarray(x0, dtype=float)
+    lower = np.asarray(lower, dtype=float)
+    if method == 'auto':
+        method = select_method(len(x0))
+
+    if not jac and executor is not None:
+        fun = lambda x, f=fun: fd_gradient(f, x, executor)
+        jac = True
+
+    fun_time = [0]
+    def timed_fun(x, fun=fun):
+        start = time.perf_counter()
+        try:
+            return fun(x)
+        finally:
+            fun_time[0] += time.perf_counter() - start
+    fun = timed_fun
+
+    start = time.perf_counter()
+
+    if method == 'projected-newton':
+        if not jac:
+            f = fun
+            fun = lambda x: (f(x), approx_fprime(x, f, np.sqrt(np.finfo(float).eps)))
+        kwargs = {} if tol is None else {'tol': tol}
+        if maxiter is not None:
+            kwargs['maxiter'] = maxiter
+        optim = projected_newton(fun, x0, lower, callback=callback, **kwargs)
+
+    elif method in METHODS:
+        options = {} if maxiter is None else {'maxiter': maxiter}
+        kwargs = {}
+        if method == 'trust-constr':
+            kwargs['hess'] = BFGS()
+            if callback is not None:
+                callback = lambda x, state, callback=callback: callback(x)
+        optim = minimize(fun, x0, jac=jac, bounds=Bounds(lower, np.inf), method=method, tol=tol,
+                         options=options, callback=callback, **kwargs)
+
+    else:
+        raise ValueError(f'Unknown method {method!r}.')
+
+    optim.wall_time = time.perf_counter() - start
+    optim.fun_time = fun_time[0]
+    metrics.add_time('solver', optim.wall_time - optim.fun_time)
+    optim.method = method
+    optim.nit = getattr(optim, 'nit', getattr(optim, 'niter', None))
+    optim.njev = getattr(optim, 'njev', optim.nfev if jac else None)
+
+    return optim
+
+
+def select_method(size, path=SOLVER_TABLE_PATH):
+    """
+    Returns the fastest method for a problem with the given number of
+    free variables according to the JSON table at path, which maps the
+    upper bounds of size ranges to methods, e.g. {"10": "SLSQP",
+    "inf": "L-BFGS-B"} (as written by the benchmark suite).
+    """
+
+    if not path or not os.path.exists(path):
+        return DEFAULT_METHOD
+
+    with open(path) as f:
+        table = json.load(f)
+
+    for bound, method in sorted(table.items(), key=lambda item: float(item[0])):
+        if size <= float(bound):
+            return method
+
+    return DEFAULT_METHOD
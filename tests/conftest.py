@@ -0,0 +1,5 @@
+import os, sys
+
+# the modules live at the top level of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('SCHEDULE_METRICS', '0')  # keep the tests out of the metrics store
@@ -0,0 +1,63 @@
+import csv, json
+import numpy as np
+
+from bulk import run, completed_ids
+from new_adaptive_scheduling import optimal_schedule
+
+
+PROBLEMS = [{'id': 'a', 'omega': 0.4, 'n': 3, 'means': '1, 1.5, 0.8', 'SCVs': 0.6},
+            {'id': 'b', 'omega': 0.5, 'n': 4, 'means': 1, 'SCVs': 1.2, 'k': 2, 'u': 0.3},
+            {'id': 'c', 'omega': 1, 'n': 3, 'means': 1, 'SCVs': 1}]
+
+
+def write_problems(path):
+
+    with open(path, 'w') as f:
+        for params in PROBLEMS:
+            f.write(json.dumps(params) + '\n')
+        f.write('not json\n')
+
+
+def read_results(path):
+
+    with open(path) as f:
+        return {row['id']: row for row in map(json.loads, f)}
+
+
+def test_inline_run(tmp_path):
+
+    problems, output = str(tmp_path / 'problems.jsonl'), str(tmp_path / 'results.jsonl')
+    write_problems(problems)
+
+    assert run(problems, output, processes=0) == {'solved': 2, 'failed': 2, 'skipped': 0}
+    results = read_results(output)
+    schedule, cost = optimal_schedule([1, 1.5, 0.8], [0.6] * 3, 0.4, [], 0)
+    assert np.allclose(results['a']['arrival_times'], schedule) and np.isclose(results['a']['cost'], cost)
+    assert results['b']['clients'] == [3, 4]
+    assert 'omega' in results['c']['error'] and 'Malformed' in results['4']['error']
+
+
+def test_interrupted_run_is_resumed(tmp_path):
+
+    problems, output = str(tmp_path / 'problems.jsonl'), str(tmp_path / 'results.jsonl')
+    write_problems(problems)
+    run(problems, output, processes=0)
+    with open(output) as f:
+        lines = f.readlines()
+    with open(output, 'w') as f:  # interrupted while writing the second result
+        f.writelines(lines[:1] + [lines[1][:10]])
+
+    assert completed_ids(output) == {'a'}
+    assert run(problems, output, processes=1) == {'solved': 1, 'failed': 2, 'skipped': 1}
+    assert read_results(output) == {row['id']: row for row in map(json.loads, lines)}
+
+
+def test_csv_output(tmp_path):
+
+    problems, output = str(tmp_path / 'problems.jsonl'), str(tmp_path / 'results.csv')
+    write_problems(problems)
+    run(problems, output, processes=0)
+
+    with open(output, newline='') as f:
+        rows = {row['id']: row for row in csv.DictReader(f)}
+    assert set(rows) == {'a', 'b', 'c', '4'} and json.loads(rows['b']['clients']) == [3, 4]
@@ -0,0 +1,30 @@
+import numpy as np
+
+from frontier import pareto_frontier
+from new_adaptive_scheduling import optimal_schedule
+
+
+EB, SCV = [1, 1.5, 0.8, 1.2], [0.6, 1.2, 0.4, 1.0]
+
+
+def test_frontier_matches_optimal_schedule():
+
+    omegas = [0.7, 0.2, 0.5, 0.3]
+    frontier = pareto_frontier(EB, SCV, omegas, [0.5], 0.8, k=2, u=0.3)
+
+    assert np.array_equal(frontier['omega'], omegas)
+    for j, omega in enumerate(omegas):
+        schedule, cost = optimal_schedule(EB, SCV, omega, [0.5], 0.8, 2, 0.3)
+        assert np.isclose(frontier['cost'][j], cost, rtol=1e-6)
+        assert np.allclose(frontier['schedule'][j], schedule, rtol=1e-3, atol=1e-3)
+        assert np.isclose(omega * frontier['EI'][j] + (1 - omega) * frontier['EW'][j], cost, rtol=1e-6)
+
+    order = np.argsort(omegas)  # more weight on idle time trades it for waiting time
+    assert np.all(np.diff(frontier['EI'][order]) < 0) and np.all(np.diff(frontier['EW'][order]) > 0)
+
+
+def test_single_client():
+
+    frontier = pareto_frontier([1], [0.5], [0.2, 0.6], tau=1.5)
+
+    assert np.array_equal(frontier['schedule'], [[1.5], [1.5]]) and not frontier['cost'].any()
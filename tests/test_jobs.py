@@ -0,0 +1,60 @@
+import time, sqlite3, subprocess, sys
+import numpy as np
+
+from contextlib import closing
+
+from jobs import JobQueue
+from new_adaptive_scheduling import optimal_schedule
+from schedule_cache import ScheduleCache
+
+
+ARGS = ([1, 1.5, 0.8], [0.6, 1.2, 0.4], 0.4, [], 0)
+
+
+def wait(queue, job_id, timeout=30):
+
+    end = time.time() + timeout
+    while time.time() < end:
+        job = queue.status(job_id)
+        if job['status'] in ('done', 'failed'):
+            return job
+        time.sleep(0.01)
+
+    raise TimeoutError(job_id)
+
+
+def make_queue(tmp_path):
+
+    path = str(tmp_path / 'cache.sqlite')
+    return JobQueue(path, workers=1, cache=ScheduleCache(path))
+
+
+def test_job_runs_to_completion(tmp_path):
+
+    queue = make_queue(tmp_path)
+    job_id = queue.submit(*ARGS)
+    job = wait(queue, job_id)
+    schedule, cost = optimal_schedule(*ARGS)
+
+    assert job['status'] == 'done' and job['error'] is None
+    assert np.allclose(job['schedule'], schedule) and np.isclose(job['cost'], cost)
+    assert queue.submit(*ARGS) == job_id and queue.status(job_id)['status'] == 'done'  # served from the cache
+    assert queue.status('unknown') is None
+
+
+def test_jobs_of_dead_workers_fail_and_are_requeued(tmp_path):
+
+    queue = make_queue(tmp_path)
+    job_id = queue.cache.normalize(*ARGS, 1, 0)[0]
+    worker = subprocess.Popen([sys.executable, '-c', 'pass'])
+    worker.wait()
+
+    with closing(sqlite3.connect(queue.path, isolation_level=None)) as con:
+        con.execute('INSERT INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                    (job_id, 'running', 3, None, None, None, None, time.time(), worker.pid))
+
+    job = queue.status(job_id)
+    assert job['status'] == 'failed' and 'gone' in job['error']
+
+    assert queue.submit(*ARGS) == job_id
+    assert wait(queue, job_id)['status'] == 'done'
@@ -0,0 +1,66 @@
+import numpy as np
+import pytest
+
+from scipy.linalg import expm
+
+from kernels import toeplitz_expm, BlockToeplitz, expm_action
+from new_adaptive_scheduling import phase_fit, create_Vn
+
+
+def make_Vn(EB, SCV):
+
+    gamma, T = zip(*[phase_fit(mean, s) for mean, s in zip(EB, SCV)])
+    return create_Vn(gamma, T, structured=True)
+
+
+@pytest.mark.parametrize('SCV', [0.3, 1.5])
+@pytest.mark.parametrize('t', [0.1, 2.5])
+def test_toeplitz_expm_matches_expm(SCV, t):
+
+    Vn = make_Vn([1] * 6, [SCV] * 6)
+    F = toeplitz_expm(Vn.blocks[0], np.outer(Vn.left[0], Vn.right[0]), t, len(Vn))
+
+    assert np.allclose(BlockToeplitz(F).todense(), expm(Vn.todense() * t), rtol=0, atol=1e-12)
+
+
+def test_block_toeplitz_products():
+
+    Vn = make_Vn([1] * 5, [0.4] * 5)
+    E = Vn.expm(1.3)
+    dense = expm(Vn.todense() * 1.3)
+    rng = np.random.default_rng(0)
+    g, v = rng.random(Vn.shape[0]), rng.random(Vn.shape[0])
+
+    assert isinstance(E, BlockToeplitz)
+    assert np.allclose(g @ E, g @ dense, rtol=0, atol=1e-12)
+    assert np.allclose(E @ v, dense @ v, rtol=0, atol=1e-12)
+
+
+def test_expm_of_leading_blocks():
+
+    Vn = make_Vn([1] * 5, [0.6] * 5)
+    Vn.expm(0.7)  # caches the full sequence
+    assert np.allclose(Vn.expm(0.7, 3).todense(), expm(Vn.todense(3) * 0.7), rtol=0, atol=1e-12)
+
+    heterogeneous = make_Vn([1, 2, 0.5], [0.3, 1.5, 0.7])
+    assert np.allclose(heterogeneous.expm(0.7), expm(heterogeneous.todense() * 0.7), rtol=0, atol=1e-12)
+
+
+def test_neg_inv_ones_matches_inverse():
+
+    Vn = make_Vn([1, 2, 0.5, 1.5], [0.3, 1.5, 0.7, 1.0])
+    vectors = Vn.neg_inv_ones()
+
+    for n in range(len(Vn)):
+        M = Vn.todense(n + 1)
+        assert np.allclose(vectors[n], -np.linalg.solve(M, np.ones(M.shape[0])))
+
+
+def test_solve_left_and_expm_action():
+
+    Vn = make_Vn([1, 2, 0.5], [0.3, 1.5, 0.7])
+    M = Vn.todense()
+    v = np.random.default_rng(1).random(M.shape[0])
+
+    assert np.allclose(Vn.solve_left(v)[0], np.linalg.solve(M.T, v))
+    assert np.allclose(expm_action(v, M, 1.7), v @ expm(M * 1.7), rtol=0, atol=1e-10)
@@ -0,0 +1,37 @@
+import numpy as np
+
+from new_adaptive_scheduling import ModelCache, ScheduleProblem, optimal_schedule, free_inter_times
+
+
+EB, SCV = [1, 1.5, 0.5, 1], [0.8, 1.2, 0.4, 1.0]
+
+
+def test_cached_models_give_the_same_cost():
+
+    schedule, cost = optimal_schedule(EB, SCV, 0.5, [], 0)
+    x = free_inter_times(schedule, 1, 0)
+
+    models = ModelCache()
+    first = ScheduleProblem.create(EB, SCV, 0.5, [], models=models)
+    second = ScheduleProblem.create(EB, SCV, 0.3, [], models=models)
+
+    assert len(models.models) == 1
+    assert second.Vn is first.Vn
+    assert np.isclose(first.evaluate(x), cost)
+    assert np.isclose(second.evaluate(x), ScheduleProblem.create(EB, SCV, 0.3, [], models=ModelCache(0)).evaluate(x))
+
+
+def test_models_are_evicted_by_size():
+
+    models = ModelCache()
+    models.get(EB, SCV)
+    size = models.nbytes()
+
+    models.max_bytes = size
+    newest = models.get(EB, SCV, u=0.5)
+    assert len(models.models) == 1  # only the newest model is kept
+    assert models.get(EB, SCV, u=0.5) is newest
+
+    disabled = ModelCache(0)
+    disabled.get(EB, SCV)
+    assert not disabled.models
@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+
+from new_adaptive_scheduling import ScheduleProblem, optimal_schedule, free_inter_times
+from policy import SchedulePolicy
+
+
+EB, SCV, OMEGA = [1, 1.5, 0.8, 1.2], [0.6, 1.2, 0.4, 1.0], 0.4
+
+
+@pytest.fixture(scope='module')
+def policy(tmp_path_factory):
+
+    path = tmp_path_factory.mktemp('policy') / 'policy.npz'
+    SchedulePolicy.build(EB, SCV, OMEGA, us=[0, 0.5, 1, 2], processes=1).save(path)
+    return SchedulePolicy.load(path)
+
+
+@pytest.mark.parametrize('remaining, k, u', [(4, 1, 0), (4, 2, 1), (3, 1, 0.75)])  # u on the grid in units of the first mean
+def test_lookup_on_the_grid_matches_optimal_schedule(policy, remaining, k, u):
+
+    schedule, cost = policy.lookup(remaining, k, u)
+    expected, expected_cost = optimal_schedule(EB[-remaining:], SCV[-remaining:], OMEGA, [], 0, k, u)
+
+    assert np.allclose(schedule, expected, rtol=1e-3, atol=1e-3)  # up to the optimizer tolerance
+    assert np.isclose(cost, expected_cost, rtol=1e-6)
+
+
+def test_lookup_between_grid_points(policy):
+
+    u = 0.3 * EB[1]
+    schedule, cost = policy.lookup(3, 2, u)
+    expected, expected_cost = optimal_schedule(EB[1:], SCV[1:], OMEGA, [], 0, 2, u)
+    exact = ScheduleProblem.create(EB[1:], SCV[1:], OMEGA, [], 2, u).evaluate(free_inter_times(schedule, 2, u))
+
+    assert expected_cost * (1 - 1e-6) <= exact <= expected_cost * 1.01
+
+    polished, polished_cost = policy.lookup(3, 2, u, polish=True)
+    assert polished_cost <= exact * (1 + 1e-9)
+
+
+def test_lookup_outside_the_grid(policy):
+
+    assert policy.lookup(3, 1, 2.5 * EB[1]) is None
+    assert policy.lookup(1, 1, 0) is None
+    assert policy.lookup(3, 3, 0) is None
@@ -0,0 +1,70 @@
+import numpy as np
+
+from new_adaptive_scheduling import optimal_schedule
+from schedule_cache import ScheduleCache, cached_schedule
+
+
+ARGS = ([1, 1.5, 0.8], [0.6, 1.2, 0.4], 0.4, [], 0)
+
+
+def test_round_trip_through_both_tiers(tmp_path):
+
+    path = str(tmp_path / 'cache.sqlite')
+    cache = ScheduleCache(path)
+    schedule, cost = cached_schedule(*ARGS, cache=cache)
+    expected, expected_cost = optimal_schedule(*ARGS)
+
+    assert np.allclose(schedule, expected) and np.isclose(cost, expected_cost)
+
+    key = cache.normalize(*ARGS, 1, 0)[0]
+    assert cache.get(key)[1] == cost
+    other = ScheduleCache(path)  # another worker process
+    assert np.array_equal(other.get(key)[0], schedule) and other.get(key)[1] == cost
+    assert cached_schedule(*ARGS, cache=other)[1] == cost
+
+
+def test_keys():
+
+    cache = ScheduleCache(None)
+    key = cache.normalize(*ARGS, 1, 0)[0]
+
+    assert cache.normalize([1, 1.5, 0.8 + 1e-9], *ARGS[1:], 1, 0)[0] == key  # rounded
+    assert cache.normalize(*ARGS, 1, 0, x0=[1, 1], maxiter=None)[0] == key  # defaults and ignored options
+    assert cache.normalize(*ARGS, 1, 0, eps=1e-6)[0] != key
+    assert cache.normalize(*ARGS, 2, 0)[0] != key
+
+
+def test_eviction(tmp_path):
+
+    cache = ScheduleCache(str(tmp_path / 'cache.sqlite'), memory_size=2, max_entries=3)
+    keys = [cache.normalize([1, 1], [s, s], 0.5, [], 0, 1, 0) for s in (0.2, 0.4, 0.6, 0.8)]
+    for key, shape, params in keys:
+        cache.put(key, shape, params, [0, 1], 1)
+
+    assert list(cache.memory) == [key for key, _, _ in keys[2:]]
+    assert cache.get(keys[0][0]) is None  # least recently used, also on disk
+    assert cache.get(keys[1][0]) is not None
+
+    cache.max_age = -1
+    assert cache.get(keys[3][0]) is None
+
+
+def test_failed_results_are_not_stored():
+
+    cache = ScheduleCache(None)
+    key, shape, params = cache.normalize(*ARGS, 1, 0)
+    cache.put(key, shape, params, [0, np.nan, 2], 1)
+    cache.put(key, shape, params, [0, 1, 2], np.inf)
+
+    assert cache.get(key) is None
+
+
+def test_nearest_seeds_and_full_output():
+
+    cache = ScheduleCache(None)
+    cached_schedule(*ARGS, cache=cache)
+    key, shape, params = cache.normalize([1, 1.5, 0.8], [0.6, 1.2, 0.4], 0.45, [], 0, 1, 0)
+    assert cache.nearest(shape, params) is not None
+
+    schedule, cost, info = cached_schedule(*ARGS, cache=cache, full_output=True)
+    assert np.isclose(cost, cached_schedule(*ARGS, cache=cache)[1]) and 'nfev' in info
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from new_adaptive_scheduling import ScheduleProblem, optimal_schedule, free_inter_times
+from schedule_table import ScheduleTable, build_table, interpolation_weights
+
+
+@pytest.fixture(scope='module')
+def table(tmp_path_factory):
+
+    path = tmp_path_factory.mktemp('table')
+    build_table(path, n_max=4, SCVs=[0.5, 1.0], omegas=[0.3, 0.6], us=[0, 1], processes=1)
+    return ScheduleTable(path)
+
+
+def test_interpolation_weights():
+
+    assert interpolation_weights([0, 1, 3], 2) == ((1, 2), (0.5, 0.5))
+    assert interpolation_weights([0, 1, 3], 3) == ((1, 2), (0, 1))
+    assert interpolation_weights([0, 1, 3], 4) is None
+
+
+@pytest.mark.parametrize('n, k, u', [(4, 1, 0), (4, 2, 1), (3, 1, 1)])
+def test_lookup_on_the_grid_matches_optimal_schedule(table, n, k, u):
+
+    mean = 2  # the table is scaled to mean 1
+    schedule, cost = table.lookup(n, mean, 0.5, 0.3, k=k, u=u * mean)
+    expected, expected_cost = optimal_schedule([mean] * n, [0.5] * n, 0.3, [], 0, k, u * mean)
+
+    assert np.allclose(schedule, expected, rtol=1e-3, atol=1e-3)  # up to the optimizer tolerance
+    assert np.isclose(cost, expected_cost, rtol=1e-6)
+
+
+def test_lookup_inside_the_grid_is_close_to_optimal(table):
+
+    schedule, cost = table.lookup(4, 1, 0.7, 0.45, k=2, u=0.5)
+    expected, expected_cost = optimal_schedule([1] * 4, [0.7] * 4, 0.45, [], 0, 2, 0.5)
+    exact = ScheduleProblem.create([1] * 4, [0.7] * 4, 0.45, [], 2, 0.5).evaluate(free_inter_times(schedule, 2, 0.5))
+
+    assert exact >= expected_cost - 1e-9
+    assert np.isclose(cost, expected_cost, rtol=0.05)
+    assert np.isclose(exact, expected_cost, rtol=0.01)
+
+    refined, refined_cost = table.lookup(4, 1, 0.7, 0.45, k=2, u=0.5, refine=True)
+    assert refined_cost <= exact + 1e-9
+
+
+def test_lookup_clips_to_tau(table):
+
+    schedule, cost = table.lookup(3, 1, 1.0, 0.6, tau=5, k=2, u=0)
+    x = free_inter_times(schedule, 2, 0)
+
+    assert x[0] == 5
+    assert np.isclose(cost, ScheduleProblem.create([1] * 3, [1.0] * 3, 0.6, [], 2, 0).evaluate(x))
+
+
+def test_lookup_outside_the_table(table):
+
+    assert table.lookup(5, 1, 0.5, 0.3) is None  # n > n_max
+    assert table.lookup(3, 1, 2.0, 0.3) is None  # SCV
+    assert table.lookup(3, 1, 0.5, 0.3, k=2, u=1.5) is None  # u
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from new_adaptive_scheduling import optimal_schedule
+from session import Session
+
+
+EB, SCV, OMEGA = [1, 1.5, 0.8, 1.2, 1], [0.6, 1.2, 0.4, 1.0, 0.8], 0.4
+
+
+def test_initial_plan_is_optimal():
+
+    session = Session(EB, SCV, OMEGA, start=10)
+    plan, cost = session.reschedule()
+    schedule, expected_cost = optimal_schedule(EB, SCV, OMEGA, [], 0)
+
+    assert np.allclose(plan, 10 + np.asarray(schedule), rtol=1e-3, atol=1e-3)
+    assert np.isclose(cost, expected_cost, rtol=1e-6)
+
+
+def test_reschedule_with_a_client_in_service():
+
+    session = Session(EB, SCV, OMEGA)
+    session.reschedule()
+    session.arrive(0)
+    session.arrive(0.5)
+    plan, cost = session.reschedule(0.7)
+    schedule, expected_cost = optimal_schedule(EB, SCV, OMEGA, [], 0, 2, 0.7)
+
+    assert len(plan) == 3
+    assert np.allclose(plan, 0.7 + np.asarray(schedule), rtol=1e-3, atol=1e-3)
+    assert np.isclose(cost, expected_cost, rtol=1e-6)
+
+
+def test_fully_fixed_plan_keeps_its_cost():
+
+    session = Session(EB, SCV, OMEGA)
+    session.reschedule()
+    session.arrive(0)
+    plan, cost = session.reschedule(0.2)
+    fixed_plan, fixed_cost = session.reschedule(fixed=len(plan))
+
+    assert np.array_equal(fixed_plan, plan)
+    assert np.isclose(fixed_cost, cost, rtol=1e-6)
+
+    fixed_plan, _ = session.reschedule(0.4, fixed=len(plan))
+    assert np.array_equal(fixed_plan, plan)
+
+
+def test_invalid_inputs():
+
+    with pytest.raises(ValueError):
+        Session(EB, SCV[:-1], OMEGA)
+    with pytest.raises(ValueError):
+        Session(EB, SCV, 1)
+    with pytest.raises(ValueError):
+        Session(EB, [0] + SCV[1:], OMEGA)
+
+    session = Session(EB, SCV, OMEGA)
+    for fixed in (-1, 0.5, len(EB) + 1):
+        with pytest.raises(ValueError):
+            session.reschedule(fixed=fixed)
+    with pytest.raises(ValueError):
+        session.reschedule(fixed=1)  # nothing is planned yet
+    with pytest.raises(ValueError):
+        session.reschedule(tau=-1)
+
+    session.arrive(1)
+    with pytest.raises(ValueError):
+        session.arrive(0.5)
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from new_adaptive_scheduling import ScheduleProblem, optimal_schedule, free_inter_times
+from simulation import PhaseType, Lognormal, simulate, residual
+
+
+EB, SCV, OMEGA = [1, 1.5, 0.8, 1.2], [0.6, 1.2, 0.4, 1.0], 0.4
+
+
+@pytest.mark.parametrize('k, u', [(1, 0), (2, 0.7)])
+def test_simulated_cost_matches_the_model(k, u):
+
+    schedule, cost = optimal_schedule(EB, SCV, OMEGA, [], 0, k, u)
+    breakdown = ScheduleProblem.create(EB, SCV, OMEGA, [], k, u).breakdown(free_inter_times(schedule, k, u))
+    samplers = [PhaseType(mean, s) for mean, s in zip(EB, SCV)]
+    result = simulate(schedule, k, u, samplers, OMEGA, reps=2 * 10**5)
+
+    assert abs(result['cost'] - cost) < 4 * result['cost_ci']
+    assert np.all(np.abs(result['EW'] - breakdown['EW']) <= 4 * result['EW_ci'] + 1e-12)
+
+
+def test_stacks_share_the_service_times():
+
+    schedule, _ = optimal_schedule(EB, SCV, OMEGA, [], 0)
+    stack = np.array([schedule, np.asarray(schedule) * 1.1])
+    samplers = [PhaseType(mean, s) for mean, s in zip(EB, SCV)]
+    result = simulate(stack, 1, 0, samplers, OMEGA, reps=10**5, chunk=3 * 10**4)
+
+    assert result['cost'].shape == (2,) and result['cost_diff'][0] == 0
+    assert np.isclose(result['cost_diff'][1], result['cost'][1] - result['cost'][0])
+    assert result['cost_diff_ci'][1] < result['cost_ci'][1]  # common random numbers
+
+
+def test_single_client():
+
+    result = simulate([0], 1, 0, PhaseType(1, 0.5), OMEGA, reps=1000)
+
+    assert result['cost'] == 0 and len(result['EW']) == 1
+
+
+def test_residual_by_rejection():
+
+    rng = np.random.default_rng(0)
+    sampler = Lognormal(1, 0.5)
+    B = residual(sampler, rng, 10**4, 1.0)
+
+    assert np.all(B > 0) and not np.isnan(B).any()